@@ -1,4 +1,12 @@
-from src.web.app import app
+from waitress import serve
+
+# Request threads; most requests wait on Bluesky or the proof worker
+THREADS = 64
 
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Imported here, not at module level: spawned proof workers re-run this
+    # script and must not pull in the web app
+    from src.web.app import app, get_components
+    # Load the model and start the proof workers before the first request
+    get_components()
+    serve(app, host='0.0.0.0', port=5000, threads=THREADS)
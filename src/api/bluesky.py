@@ -1,12 +1,120 @@
-from atproto import Client
+from atproto import Client, AsyncClient
+from atproto_client.request import Request, AsyncRequest
+import httpx
+import asyncio
 import logging
+import threading
+import time
+from collections import OrderedDict
+from operator import attrgetter
+from concurrent.futures import ThreadPoolExecutor, wait
 from src.api.keyword_extractor import KeywordExtractor
 
+# Upper bound on concurrent keyword searches; these are I/O-bound so we don't
+# tie this to the CPU count.
+MAX_SEARCH_WORKERS = 8
+# Seconds to wait for all keyword searches of a question to come back
+SEARCH_TIMEOUT = 30
+# Search results are reused for this many seconds
+SEARCH_CACHE_TTL = 300
+SEARCH_CACHE_SIZE = 256
+# Keywords OR-ed together into the single combined search query
+MAX_QUERY_KEYWORDS = 5
+# Keep-alive pool shared by every call a client makes to bsky.social
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=40)
+
+
+# Attribute paths that hold the post text, tried in order
+_TEXT_PATHS = tuple(attrgetter(path) for path in (
+    'record.text',
+    'post.record.text',
+    'value.text',
+    'text',
+    'reply.root.record.text',
+    'params.text',
+))
+
+
+class _PooledRequest(Request):
+    """atproto request backend with a sized keep-alive connection pool."""
+
+    def __init__(self):
+        super().__init__()
+        self._client.close()
+        self._client = httpx.Client(follow_redirects=True, limits=HTTP_LIMITS)
+
+    def close(self):
+        """Close the pooled connections."""
+        self._client.close()
+
+
+class _PooledAsyncRequest(AsyncRequest):
+    """Async counterpart of _PooledRequest."""
+
+    def __init__(self):
+        super().__init__()
+        # AsyncRequest's own client can only be closed by awaiting aclose(),
+        # so it is kept until aclose() instead of being dropped unclosed
+        self._default_client = self._client
+        self._client = httpx.AsyncClient(follow_redirects=True, limits=HTTP_LIMITS)
+
+    async def aclose(self):
+        """Close both the pooled and the replaced httpx client."""
+        await self._default_client.aclose()
+        await self._client.aclose()
+
+
+class _SearchCache:
+    """Small thread-safe LRU cache with per-entry expiry for search results."""
+
+    def __init__(self, maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            timestamp, posts = entry
+            if time.monotonic() - timestamp >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return list(posts)
+
+    def put(self, key, posts):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), list(posts))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
 class BlueskyAPI:
-    def __init__(self, username=None, password=None):
-        self.client = Client()
+    def __init__(self, username=None, password=None, combined_search=True):
+        # One pooled HTTP client keeps the TCP/TLS connection to the PDS warm
+        # across searches; httpx reconnects on its own if the server closes it
+        self._request = _PooledRequest()
+        self.client = Client(request=self._request)
+        # Guards session changes; searches share the pool without locking
+        self._session_lock = threading.Lock()
         self.is_authenticated = False
+        # One OR-query per question instead of one search per keyword;
+        # False restores the per-keyword fan-out for comparison
+        self.combined_search = combined_search
         self.keyword_extractor = KeywordExtractor()
+        self._executor = ThreadPoolExecutor(max_workers=MAX_SEARCH_WORKERS)
+        self._search_cache = _SearchCache()
+        # Async client is created lazily and reused while the event loop and
+        # session stay the same; callers should keep one loop alive (see App)
+        self._aclient = None
+        self._arequest = None
+        self._aclient_loop = None
+        # Set by login(); the async client is rebuilt with the new session
+        self._aclient_stale = False
         if username and password:
             self.login(username, password)
 
@@ -19,7 +127,10 @@ class BlueskyAPI:
                 
             # Try to login
             logging.info(f"Attempting to login with username: {username}")
-            session = self.client.login(username, password)
+            with self._session_lock:
+                session = self.client.login(username, password)
+                # Any async client still holds the previous session
+                self._aclient_stale = True
             self.is_authenticated = True
             logging.info("Successfully logged in to Bluesky")
             return True
@@ -28,52 +139,96 @@ class BlueskyAPI:
             self.is_authenticated = False
             return False
 
+    @staticmethod
+    def _extract_post_texts(response):
+        """Pull the post texts out of a search_posts response."""
+        # Debug full response structure; %-args so the (large) model is only
+        # rendered when debug logging is actually enabled
+        logging.debug("Response structure: %s", response)
+        
+        posts = []
+        for post in response.posts:
+            try:
+                # Extract text based on current API structure
+                for getter in _TEXT_PATHS:
+                    try:
+                        posts.append(getter(post))
+                        break
+                    except AttributeError:
+                        continue
+                # No known path matched (e.g. record came back as a plain dict):
+                # dump only the two fields we read rather than the whole model
+                else:
+                    dump = getattr(post, 'model_dump', None)
+                    post_dict = dump(include={'record', 'text'}) if dump else {}
+                    record = post_dict.get('record')
+                    text = record.get('text') if isinstance(record, dict) else post_dict.get('text')
+                    if text is not None:
+                        posts.append(text)
+                    else:
+                        logging.warning("Unknown post shape: %s", type(post).__name__)
+
+            except Exception as e:
+                logging.warning("Could not extract text from post: %s", e)
+        
+        return posts
+
     def fetch_posts_by_keyword(self, keyword, limit=10):
         """Fetch posts containing the given keyword."""
+        cache_key = (keyword.lower(), limit)
+        cached = self._search_cache.get(cache_key)
+        if cached is not None:
+            return cached
         try:
             response = self.client.app.bsky.feed.search_posts({"q": keyword, "limit": limit})
-            
-            # Debug full response structure
-            logging.debug(f"Response structure: {response}")
-            
-            posts = []
-            for post in response.posts:
-                try:
-                    # Extract text based on current API structure
-                    if hasattr(post, 'record') and hasattr(post.record, 'text'):
-                        posts.append(post.record.text)
-                    elif hasattr(post, 'post') and hasattr(post.post, 'record') and hasattr(post.post.record, 'text'):
-                        posts.append(post.post.record.text)
-                    elif hasattr(post, 'value') and hasattr(post.value, 'text'):
-                        posts.append(post.value.text)
-                    # New structure handling for current API
-                    else:
-                        # Get all available attributes to find the text
-                        attrs = dir(post)
-                        logging.debug(f"Post attributes: {attrs}")
-                        
-                        # Try to find text in various locations
-                        if 'text' in attrs:
-                            posts.append(post.text)
-                        elif hasattr(post, 'reply') and hasattr(post.reply, 'root') and hasattr(post.reply.root, 'record'):
-                            posts.append(post.reply.root.record.text)
-                        elif hasattr(post, 'params') and hasattr(post.params, 'text'):
-                            posts.append(post.params.text)
-                        # Attempt to extract from nested objects
-                        else:
-                            # Convert to dictionary for easier exploration
-                            post_dict = post.dict() if hasattr(post, 'dict') else vars(post)
-                            logging.debug(f"Post dictionary: {post_dict}")
-                            
-                            # Extract text from the dictionary (check common paths)
-                            if 'record' in post_dict and isinstance(post_dict['record'], dict) and 'text' in post_dict['record']:
-                                posts.append(post_dict['record']['text'])
-                            elif 'text' in post_dict:
-                                posts.append(post_dict['text'])
-
-                except Exception as e:
-                    logging.warning(f"Could not extract text from post: {e}")
-            
+            posts = self._extract_post_texts(response)
+            self._search_cache.put(cache_key, posts)
+            return posts
+        except Exception as e:
+            logging.error(f"Error fetching posts by keyword: {e}")
+            return []
+
+    async def _get_async_client(self):
+        """Return an AsyncClient bound to the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._aclient is not None and (self._aclient_loop is not loop or self._aclient_stale):
+            await self.aclose()
+        if self._aclient is None:
+            arequest = _PooledAsyncRequest()
+            aclient = AsyncClient(request=arequest)
+            with self._session_lock:
+                self._aclient_stale = False
+                session_string = self.client.export_session_string() if self.is_authenticated else None
+            if session_string:
+                # Reuse the sync session instead of logging in a second time
+                await aclient.login(session_string=session_string)
+            self._aclient = aclient
+            self._arequest = arequest
+            self._aclient_loop = loop
+        return self._aclient
+
+    async def aclose(self):
+        """Close the async client's connections; call it on the loop that used them."""
+        arequest, self._aclient, self._arequest, self._aclient_loop = self._arequest, None, None, None
+        if arequest is None:
+            return
+        try:
+            await arequest.aclose()
+        except Exception as e:
+            # Connections opened on a loop that has since closed can't be shut down cleanly
+            logging.debug("Error closing async Bluesky client: %s", e)
+
+    async def fetch_posts_by_keyword_async(self, keyword, limit=10):
+        """Async variant of fetch_posts_by_keyword."""
+        cache_key = (keyword.lower(), limit)
+        cached = self._search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            aclient = await self._get_async_client()
+            response = await aclient.app.bsky.feed.search_posts({"q": keyword, "limit": limit})
+            posts = self._extract_post_texts(response)
+            self._search_cache.put(cache_key, posts)
             return posts
         except Exception as e:
             logging.error(f"Error fetching posts by keyword: {e}")
@@ -99,8 +254,33 @@ class BlueskyAPI:
             logging.error(f"Error fetching recent posts: {e}")
             return []
 
-    # Updated fetch_posts_for_question method
+    @staticmethod
+    def _combined_query(keywords):
+        """
+        Build one search query matching any of the top keywords.
+        
+        Multi-word keywords are quoted so each still matches as a phrase, as
+        it did when searched on its own.
+        """
+        terms = []
+        for keyword in keywords[:MAX_QUERY_KEYWORDS]:
+            if any(ch.isspace() for ch in keyword):
+                keyword = '"' + keyword.replace('"', '\\"') + '"'
+            terms.append(keyword)
+        return " OR ".join(terms)
+
     def fetch_posts_for_question(self, question, limit=20):
+        """Fetch posts relevant to a question with a single combined search."""
+        if not self.combined_search:
+            return self._fetch_posts_for_question_legacy(question, limit)
+        keywords = self.keyword_extractor.extract_keywords_from_question(question)
+        if not keywords:
+            return []
+        posts = self.fetch_posts_by_keyword(self._combined_query(keywords), limit)
+        return self._merge_unique([posts], limit)
+
+    def _fetch_posts_for_question_legacy(self, question, limit=20):
+        """Per-keyword fan-out kept for A/B comparison with the combined search."""
         keywords = self.keyword_extractor.extract_keywords_from_question(question)
         
         # Try multi-keyword search first for better relevance
@@ -114,12 +294,99 @@ class BlueskyAPI:
                 return combined_posts
         
         # Fall back to original approach if needed
-        all_posts = []
         posts_per_keyword = limit // len(keywords) if keywords else limit
         
-        for keyword in keywords:
-            posts = self.fetch_posts_by_keyword(keyword, limit=posts_per_keyword)
-            all_posts.extend(posts)
+        # Keyword searches are independent, so run them concurrently
+        futures = [
+            self._executor.submit(self.fetch_posts_by_keyword, keyword, posts_per_keyword)
+            for keyword in keywords
+        ]
+        done, not_done = wait(futures, timeout=SEARCH_TIMEOUT)
+        if not_done:
+            logging.warning("Timed out waiting for keyword searches, using partial results")
+        
+        # Merge in keyword order so the first keyword's matches survive the cut
+        return self._merge_unique((f.result() for f in futures if f in done), limit)
+
+    @staticmethod
+    def _merge_unique(post_lists, limit):
+        """Concatenate post lists, dropping duplicates and keeping first-seen order."""
+        seen = set()
+        merged = []
+        for posts in post_lists:
+            for post in posts:
+                if post not in seen:
+                    seen.add(post)
+                    merged.append(post)
+                    if len(merged) >= limit:
+                        return merged
+        return merged
+
+    async def fetch_posts_for_question_async(self, question, limit=20):
+        """Async variant of fetch_posts_for_question using a single event loop."""
+        keywords = self.keyword_extractor.extract_keywords_from_question(question)
+        if not keywords:
+            return []
+        # Make sure the client exists before fanning out
+        try:
+            await self._get_async_client()
+        except Exception as e:
+            logging.error(f"Failed to create async Bluesky client: {e}")
+            return []
+        
+        if self.combined_search:
+            posts = await self.fetch_posts_by_keyword_async(self._combined_query(keywords), limit)
+            return self._merge_unique([posts], limit)
+        
+        if len(keywords) >= 2:
+            combined_query = " ".join(keywords[:3])
+            combined_posts = await self.fetch_posts_by_keyword_async(combined_query, limit=limit)
+            if len(combined_posts) >= limit//2:
+                return combined_posts
+        
+        posts_per_keyword = limit // len(keywords) if keywords else limit
+        results = await asyncio.gather(
+            *(self.fetch_posts_by_keyword_async(keyword, posts_per_keyword) for keyword in keywords)
+        )
         
         # Deduplicate and return
-        return list(set(all_posts))[:limit]
+        return self._merge_unique(results, limit)
+
+    async def iter_posts_for_question_async(self, question, limit=20):
+        """
+        Yield batches of new, unique posts for a question as searches complete.
+        
+        Lets callers start processing the first results while the remaining
+        searches (per-keyword when combined_search is off) are still in flight.
+        """
+        keywords = self.keyword_extractor.extract_keywords_from_question(question)
+        if not keywords:
+            return
+        try:
+            await self._get_async_client()
+        except Exception as e:
+            logging.error(f"Failed to create async Bluesky client: {e}")
+            return
+        
+        if self.combined_search:
+            searches = [self.fetch_posts_by_keyword_async(self._combined_query(keywords), limit)]
+        else:
+            posts_per_keyword = limit // len(keywords)
+            searches = [self.fetch_posts_by_keyword_async(keyword, posts_per_keyword) for keyword in keywords]
+        
+        seen = set()
+        for search in asyncio.as_completed(searches):
+            batch = []
+            for post in await search:
+                if post not in seen and len(seen) < limit:
+                    seen.add(post)
+                    batch.append(post)
+            if batch:
+                yield batch
+            if len(seen) >= limit:
+                return
+
+    def close(self):
+        """Release the background search workers and the pooled HTTP connections (see aclose() for the async client)."""
+        self._executor.shutdown(wait=False)
+        self._request.close()
@@ -1,19 +1,74 @@
 import spacy
 import logging
+from functools import lru_cache
 from typing import List, Dict, Any, Set
 from collections import Counter
 
+# Pipeline components none of the extraction methods rely on
+_UNUSED_PIPES = ("lemmatizer", "textcat")
+# Number of distinct questions whose keywords are memoized
+QUESTION_CACHE_SIZE = 512
+# Docs per batch when streaming texts through nlp.pipe
+PIPE_BATCH_SIZE = 64
+
+# Lookup sets used on every question
+_QUESTION_WORDS = frozenset({'what', 'when', 'where', 'who', 'why', 'how'})
+_SPECIAL_TERMS = frozenset({'ai', 'ml', 'ui', 'ux', 'vr', 'ar'})
+_TEXT_POS = frozenset({'NOUN', 'PROPN', 'ADJ'})
+_QUESTION_POS = frozenset({'NOUN', 'PROPN', 'ADJ', 'VERB'})
+# Penn Treebank tags of plural nouns
+_PLURAL_TAGS = frozenset({'NNS', 'NNPS'})
+
+def _singular_words(text: str, plurals: Set[str]) -> str:
+    """Fold words tagged as plural ("networks" -> "network") for comparison."""
+    return " ".join(word[:-1] if word in plurals and word.endswith('s') and not word.endswith('ss') else word
+                    for word in text.split())
+
+def _prune_redundant(keywords, plurals: Set[str] = frozenset()) -> List[str]:
+    """
+    Drop keywords already covered by a longer one, e.g. "intelligence" next to
+    "artificial intelligence" or "network" next to "networks", so each search
+    term adds something new. Longest keywords come first.
+    
+    Only words in plurals (lowercased tokens the tagger marked as plural nouns)
+    are folded, so e.g. "news" and "new" stay separate keywords.
+    """
+    kept = []
+    kept_folded = []
+    for keyword in sorted(keywords, key=lambda k: (-len(k), k)):
+        folded = f" {_singular_words(keyword, plurals)} "
+        if any(folded in other for other in kept_folded):
+            continue
+        kept.append(keyword)
+        kept_folded.append(folded)
+    return kept
+
+@lru_cache(maxsize=4)
+def _load_model(model_name: str):
+    """Load a spaCy pipeline once per process and share it between extractors."""
+    nlp = spacy.load(model_name)
+    # noun_chunks needs the parser, so only drop what we never read
+    for pipe in _UNUSED_PIPES:
+        if pipe in nlp.pipe_names:
+            nlp.disable_pipe(pipe)
+    return nlp
+
 class KeywordExtractor:
     """Advanced keyword extraction using spaCy for better post relevance."""
     
     def __init__(self, model_name="en_core_web_sm"):
         """Initialize the keyword extractor with the spaCy model."""
         try:
-            self.nlp = spacy.load(model_name)
+            self.nlp = _load_model(model_name)
             logging.info(f"Loaded spaCy model: {model_name}")
         except Exception as e:
             logging.error(f"Failed to load spaCy model: {e}")
             raise
+        
+        # Per-instance memo of question -> keywords (lru_cache can't hash self)
+        self._question_keywords = lru_cache(maxsize=QUESTION_CACHE_SIZE)(
+            self._extract_keywords_from_question
+        )
 
     def extract_keywords(self, text: str, top_n: int = 5) -> List[str]:
         """
@@ -26,9 +81,25 @@ class KeywordExtractor:
         Returns:
             List of extracted keywords
         """
-        # Process the text with spaCy
-        doc = self.nlp(text)
+        return self._keywords_from_doc(self.nlp(text), top_n)
+
+    def extract_keywords_batch(self, texts: List[str], top_n: int = 5) -> List[List[str]]:
+        """
+        Extract keywords from many texts in one spaCy pass.
         
+        Args:
+            texts: Input texts to extract keywords from
+            top_n: Number of top keywords to return per text
+            
+        Returns:
+            List of keyword lists, one per input text
+        """
+        return [self._keywords_from_doc(doc, top_n)
+                for doc in self.nlp.pipe(texts, batch_size=PIPE_BATCH_SIZE)]
+
+    @staticmethod
+    def _keywords_from_doc(doc, top_n: int) -> List[str]:
+        """Rank keywords of an already processed spaCy Doc."""
         # Extract keywords using different methods
         keywords = []
         
@@ -41,7 +112,7 @@ class KeywordExtractor:
         # Method 3: Extract important words based on POS tags
         # Focus on nouns, proper nouns, and adjectives
         important_words = [token.text.lower() for token in doc 
-                        if (token.pos_ in ['NOUN', 'PROPN', 'ADJ'] and 
+                        if (token.pos_ in _TEXT_POS and 
                             not token.is_stop and 
                             len(token.text) > 3)]
         
@@ -63,6 +134,13 @@ class KeywordExtractor:
         Returns:
             List of keywords
         """
+        # Collapse whitespace so trivially different questions share a cache
+        # entry; case is kept because NER depends on it
+        normalized = " ".join(question.split())
+        return list(self._question_keywords(normalized, min_length))
+
+    def _extract_keywords_from_question(self, question: str, min_length: int) -> tuple:
+        """Uncached keyword extraction behind extract_keywords_from_question."""
         # Process with spaCy
         doc = self.nlp(question)
         
@@ -83,19 +161,20 @@ class KeywordExtractor:
         for token in doc:
             # Skip stopwords, short words, and non-relevant parts of speech
             if (token.is_stop or len(token.text) < min_length or 
-                token.pos_ not in ['NOUN', 'PROPN', 'ADJ', 'VERB']):
+                token.pos_ not in _QUESTION_POS):
                 continue
                 
             # Skip common question words
-            if token.text.lower() in ['what', 'when', 'where', 'who', 'why', 'how']:
+            if token.text.lower() in _QUESTION_WORDS:
                 continue
                 
             keywords.add(token.text.lower())
         
         # Special case for acronyms and important short words
-        special_terms = ["ai", "ml", "ui", "ux", "vr", "ar"]
-        for term in special_terms:
-            if term in question.lower():
+        question_lower = question.lower()
+        for term in _SPECIAL_TERMS:
+            if term in question_lower:
                 keywords.add(term)
         
-        return list(keywords)
+        plurals = {token.lower_ for token in doc if token.tag_ in _PLURAL_TAGS}
+        return tuple(_prune_redundant(keywords, plurals))
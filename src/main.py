@@ -1,13 +1,13 @@
 import logging
 import argparse
+import asyncio
 import os
-from src.api.bluesky import BlueskyAPI
-from src.ml.sentiment import EmotionAnalyzer
-from src.zk.ezkl_integration import EZKLIntegrator  # Updated import path
-import matplotlib.pyplot as plt
-import numpy as np
+import sys
 from src.utils.setup_directories import setup_directories
 
+# Heavy dependencies (torch/transformers, ezkl, matplotlib, spaCy) are imported
+# inside the code paths that need them so that e.g. --help stays fast.
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -21,137 +21,271 @@ def setup_environment():
     logging.info(f"Environment setup complete. Project root: {directories['project_root']}")
     return directories
 
+# Posts printed with their dominant emotion in CLI output
+SAMPLE_SIZE = 3
+
+# Chart figure reused across visualize_emotions calls
+_FIGURE = None
+
 def visualize_emotions(emotion_result, output_path="results/emotion_analysis.png"):
     """Create a visualization of emotion results."""
+    global _FIGURE
+    if _FIGURE is None:
+        import matplotlib
+        # Headless rendering: skips GUI toolkit initialisation
+        matplotlib.use("Agg")
+        from matplotlib.figure import Figure
+        # Built once without pyplot, so nothing is registered globally and
+        # the layout is solved on save instead of via tight_layout each call
+        _FIGURE = Figure(figsize=(12, 7), constrained_layout=True)
+    fig = _FIGURE
+    fig.clear()
+    
     labels = list(emotion_result['emotion_counts'].keys())
     values = list(emotion_result['emotion_counts'].values())
     
-    # Define colors for each emotion
-    colors = [
-        '#FFD700',  # joy - Gold
-        '#FF8C00',  # surprise - Dark Orange
-        '#A9A9A9',  # neutral - Dark Gray
-        '#1E90FF',  # sadness - Dodger Blue
-        '#800080',  # fear - Purple
-        '#FF0000',  # anger - Red
-        '#006400',  # disgust - Dark Green
-    ]
+    # Colors for each emotion, in the order emotion_counts lists them
+    from src.ml.sentiment import EmotionAnalyzer
+    colors = EmotionAnalyzer.ORDERED_COLORS
     
     # Create bar chart
-    plt.figure(figsize=(12, 7))
-    bars = plt.bar(labels, values, color=colors[:len(labels)])
+    ax = fig.add_subplot(111)
+    bars = ax.bar(labels, values, color=colors[:len(labels)])
     
     # Add labels and title
-    plt.xlabel('Emotion')
-    plt.ylabel('Number of Posts')
-    plt.title('Emotion Analysis Results')
+    ax.set_xlabel('Emotion')
+    ax.set_ylabel('Number of Posts')
+    ax.set_title('Emotion Analysis Results')
     
     # Add text labels on top of each bar
     for bar in bars:
         height = bar.get_height()
-        plt.text(bar.get_x() + bar.get_width()/2., height + 0.1,
-                 f'{height}', ha='center', va='bottom')
+        ax.text(bar.get_x() + bar.get_width()/2., height + 0.1,
+                f'{height}', ha='center', va='bottom')
     
     # Add overall emotion
-    plt.figtext(0.5, 0.01, 
-                f"Overall Emotion: {emotion_result['overall_emotion']}",
-                ha="center", fontsize=12, 
-                bbox={"facecolor":"orange", "alpha":0.2, "pad":5})
+    fig.text(0.5, 0.01, 
+             f"Overall Emotion: {emotion_result['overall_emotion']}",
+             ha="center", fontsize=12, 
+             bbox={"facecolor":"orange", "alpha":0.2, "pad":5})
     
     # Save the figure
-    plt.tight_layout()
-    plt.savefig(output_path)
+    fig.savefig(output_path, dpi=100)
     logging.info(f"Emotion visualization saved to {output_path}")
     return output_path
 
-def main():
-    """Main entry point for the application."""
-    parser = argparse.ArgumentParser(description='Privacy-preserving emotion analysis on Bluesky posts.')
-    parser.add_argument('--question', type=str, help='Question to analyze emotions for')
-    parser.add_argument('--username', type=str, help='Bluesky username')
-    parser.add_argument('--password', type=str, help='Bluesky password')
-    parser.add_argument('--export-model', action='store_true', help='Export model to ONNX format')
-    parser.add_argument('--prepare-ezkl', action='store_true', help='Prepare EZKL environment')
-    parser.add_argument('--visualize', action='store_true', help='Create visualization of emotion results')
+class App:
+    """
+    Long-lived holder for the Bluesky client, emotion model and EZKL integrator.
     
-    args = parser.parse_args()
+    Each component is built on first use and then kept for the lifetime of the
+    App, so repeated analyze() calls (e.g. from a server wrapper) don't log in
+    or load models again, while CLI runs only pay for what they use.
+    """
     
-    # Set up environment
-    setup_environment()
+    def __init__(self, username=None, password=None, quantize=None, use_teacher=False):
+        self.username = username
+        self.password = password
+        self.quantize = quantize
+        self.use_teacher = use_teacher
+        self._bluesky_api = None
+        self._emotion_analyzer = None
+        self._ezkl_integrator = None
+        # One event loop for the App's lifetime, so the async Bluesky client
+        # (and its session) is reused across analyze() calls
+        self._loop = None
+    
+    @property
+    def bluesky_api(self):
+        if self._bluesky_api is None:
+            from src.api.bluesky import BlueskyAPI
+            self._bluesky_api = BlueskyAPI(self.username, self.password)
+        return self._bluesky_api
     
-    # Initialize emotion analyzer
-    logging.info("Initializing emotion analyzer...")
-    emotion_analyzer = EmotionAnalyzer()
+    @property
+    def emotion_analyzer(self):
+        if self._emotion_analyzer is None:
+            from src.ml.sentiment import get_emotion_analyzer
+            logging.info("Initializing emotion analyzer...")
+            self._emotion_analyzer = get_emotion_analyzer(quantize=self.quantize, use_teacher=self.use_teacher)
+        return self._emotion_analyzer
     
-    # Export model if requested
-    if args.export_model:
+    @property
+    def model_path(self):
+        """ONNX export of the selected emotion model, shared with EZKL."""
+        from src.ml.sentiment import resolve_model
+        return resolve_model(self.use_teacher)[1]
+    
+    @property
+    def ezkl_integrator(self):
+        if self._ezkl_integrator is None:
+            from src.zk.ezkl_integration import EZKLIntegrator
+            self._ezkl_integrator = EZKLIntegrator(model_path=self.model_path)
+        return self._ezkl_integrator
+    
+    def export_model(self, output_path=None, precision=None):
+        """Export the emotion model to ONNX, returning the path or None."""
         logging.info("Exporting model to ONNX format...")
-        onnx_path = emotion_analyzer.export_to_onnx("models/emotion_model.onnx")
+        onnx_path = self.emotion_analyzer.export_to_onnx(output_path or self.model_path, precision=precision)
         if not onnx_path or not os.path.exists(onnx_path):
             logging.error(f"Model export failed, path not found: {onnx_path}")
-            sys.exit(1)
+            return None
         logging.info(f"Model exported to {onnx_path}")
+        return onnx_path
     
-    # Initialize EZKL integrator
-    ezkl_integrator = EZKLIntegrator(model_path="models/emotion_model.onnx")
-    
-    # Prepare EZKL environment if requested
-    if args.prepare_ezkl:
+    def prepare_ezkl(self):
+        """Generate the EZKL circuit and keys for the exported model."""
         logging.info("Preparing EZKL environment...")
-        if not os.path.exists("models/emotion_model.onnx"):
-            logging.error("Cannot prepare EZKL: model file doesn't exist at models/emotion_model.onnx")
-            sys.exit(1)
+        if not os.path.exists(self.model_path):
+            logging.error(f"Cannot prepare EZKL: model file doesn't exist at {self.model_path}")
+            return False
         
-        success = ezkl_integrator.prepare_model()
-        if not success:
+        if not self.ezkl_integrator.prepare_model():
             logging.error("Failed to prepare EZKL environment")
-            sys.exit(1)
+            return False
         logging.info("EZKL environment prepared successfully")
+        return True
     
-    # If a question is provided, fetch posts and analyze emotions
-    if args.question:
-        logging.info(f"Processing question: {args.question}")
+    def calibrate(self):
+        """Write a static INT8 model calibrated on the posts analyzed so far, returning its path or None."""
+        logging.info("Calibrating static INT8 model...")
+        return self.emotion_analyzer.calibrate()
+    
+    def analyze(self, question, detail_limit=None):
+        """
+        Fetch posts for a question and analyze their emotions.
+        
+        Args:
+            question: Question to search posts for
+            detail_limit: Number of leading posts to include per-post emotions for
         
-        # Initialize Bluesky API
-        bluesky_api = BlueskyAPI(args.username, args.password)
+        Returns:
+            Tuple of (posts, emotion_result); emotion_result is None when no
+            posts were found
+        """
+        logging.info(f"Processing question: {question}")
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(self._analyze_async(question, detail_limit))
+    
+    async def _analyze_async(self, question, detail_limit=None):
+        """
+        Overlap fetching with model loading and scoring.
+        
+        The emotion model loads while the searches are in flight, and each batch
+        of posts is scored on a worker thread as soon as it arrives.
+        """
+        import numpy as np
+        
+        loop = asyncio.get_running_loop()
+        analyzer_ready = loop.run_in_executor(None, lambda: self.emotion_analyzer)
         
         # Fetch posts
         logging.info("Fetching relevant posts...")
-        posts = bluesky_api.fetch_posts_for_question(args.question)
+        posts, scoring = [], []
+        async for batch in self.bluesky_api.iter_posts_for_question_async(question):
+            analyzer = await analyzer_ready
+            posts.extend(batch)
+            scoring.append(loop.run_in_executor(None, analyzer.score_matrix, batch))
         
         if not posts:
             logging.warning("No posts found for the given question")
-            return
+            return posts, None
         
         logging.info(f"Found {len(posts)} relevant posts")
         
         # Analyze emotions
         logging.info("Analyzing emotions...")
-        emotion_result = emotion_analyzer.get_aggregate_emotions(posts)
-        
-        # Create visualization if requested
-        if args.visualize:
-            visualize_emotions(emotion_result)
-        
-        # Display sample posts
-        sample_size = min(3, len(posts))
-        sample_posts = posts[:sample_size]
+        matrices = await asyncio.gather(*scoring, return_exceptions=True)
+        errors = [matrix for matrix in matrices if isinstance(matrix, Exception)]
+        if errors:
+            # Let the analyzer score all posts again (cached rows are reused)
+            logging.error(f"Error scoring fetched posts: {errors[0]}")
+            scores = None
+        else:
+            # Batches were scored in posts order
+            scores = np.vstack(matrices)
         
-        # Display emotions analysis results
-        print("\n--- Emotion Analysis Results ---")
-        print(f"Question: {args.question}")
-        print(f"Number of posts analyzed: {len(posts)}")
-        print(f"Overall emotion: {emotion_result['overall_emotion']}")
-        print("Emotion breakdown:")
-        for emotion, count in emotion_result['emotion_counts'].items():
-            print(f"  - {emotion}: {count}")
+        analyzer = await analyzer_ready
+        return posts, analyzer.get_aggregate_emotions(posts, detail_limit=detail_limit, scores=scores)
+    
+    def close(self):
+        if self._loop is not None:
+            if self._bluesky_api is not None:
+                self._loop.run_until_complete(self._bluesky_api.aclose())
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
+            self._loop = None
+        if self._bluesky_api is not None:
+            self._bluesky_api.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def main():
+    """Main entry point for the application."""
+    parser = argparse.ArgumentParser(description='Privacy-preserving emotion analysis on Bluesky posts.')
+    parser.add_argument('--question', type=str, help='Question to analyze emotions for')
+    parser.add_argument('--username', type=str, help='Bluesky username')
+    parser.add_argument('--password', type=str, help='Bluesky password')
+    parser.add_argument('--export-model', action='store_true', help='Export model to ONNX format')
+    parser.add_argument('--prepare-ezkl', action='store_true', help='Prepare EZKL environment')
+    parser.add_argument('--visualize', action='store_true', help='Create visualization of emotion results')
+    parser.add_argument('--quantize', choices=['int8'], help='Run emotion inference on a quantized ONNX model')
+    parser.add_argument('--calibrate', action='store_true', help='Calibrate a static INT8 model on the posts analyzed for --question (used with --quantize int8)')
+    parser.add_argument('--precision', choices=['fp16'], help='Also export a reduced-precision ONNX model for GPU inference')
+    parser.add_argument('--teacher', action='store_true', help='Use the full-size emotion model even if a distilled one exists')
+    
+    args = parser.parse_args()
+    
+    # Set up environment
+    setup_environment()
+    
+    with App(args.username, args.password, quantize=args.quantize, use_teacher=args.teacher) as app:
+        # Export model if requested
+        if args.export_model and not app.export_model(precision=args.precision):
+            sys.exit(1)
         
-        print("\nSample posts:")
-        for i, post in enumerate(sample_posts):
-            emotion_data = emotion_result['emotions_data'][i]
-            print(f"\n[{i+1}] [{emotion_data['dominant_emotion']}] {post[:100]}..." if len(post) > 100 else f"\n[{i+1}] [{emotion_data['dominant_emotion']}] {post}")
+        # Prepare EZKL environment if requested
+        if args.prepare_ezkl and not app.prepare_ezkl():
+            sys.exit(1)
         
-        print("\nNOTE: In a complete implementation, a zero-knowledge proof would be generated to verify the emotion analysis without revealing the posts.")
+        # If a question is provided, fetch posts and analyze emotions
+        if args.question:
+            posts, emotion_result = app.analyze(args.question, detail_limit=SAMPLE_SIZE)
+            if emotion_result is None:
+                return
+            
+            # Calibrate on the posts just analyzed if requested
+            if args.calibrate and not app.calibrate():
+                sys.exit(1)
+            
+            # Create visualization if requested
+            if args.visualize:
+                visualize_emotions(emotion_result)
+            
+            # Display sample posts
+            sample_size = min(SAMPLE_SIZE, len(posts))
+            sample_posts = posts[:sample_size]
+            
+            # Display emotions analysis results
+            print("\n--- Emotion Analysis Results ---")
+            print(f"Question: {args.question}")
+            print(f"Number of posts analyzed: {len(posts)}")
+            print(f"Overall emotion: {emotion_result['overall_emotion']}")
+            print("Emotion breakdown:")
+            for emotion, count in emotion_result['emotion_counts'].items():
+                print(f"  - {emotion}: {count}")
+            
+            print("\nSample posts:")
+            for i, post in enumerate(sample_posts):
+                emotion_data = emotion_result['emotions_data'][i]
+                print(f"\n[{i+1}] [{emotion_data['dominant_emotion']}] {post[:100]}..." if len(post) > 100 else f"\n[{i+1}] [{emotion_data['dominant_emotion']}] {post}")
+            
+            print("\nNOTE: In a complete implementation, a zero-knowledge proof would be generated to verify the emotion analysis without revealing the posts.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,92 @@
+import queue
+import threading
+import time
+from collections.abc import Mapping
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional
+import numpy as np
+from src.ml.sentiment import EmotionAnalyzer
+
+# Large enough that one /analyze request (up to 50 posts) is a single forward pass
+MAX_BATCH = 64
+
+
+class BatchingEmotionAnalyzer:
+    """
+    Coalesces concurrent analyze() calls into shared forward passes.
+    
+    Texts submitted from any thread within max_wait_ms of each other are scored
+    together (up to max_batch at a time) by a single worker thread, sorted by
+    length to limit padding, and each row is handed back to its caller.
+    Other attributes are delegated to the wrapped EmotionAnalyzer.
+    """
+    
+    def __init__(self, analyzer: EmotionAnalyzer, max_batch: int = MAX_BATCH, max_wait_ms: float = 10):
+        self.analyzer = analyzer
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="emotion-batcher", daemon=True)
+        self._worker.start()
+    
+    def __getattr__(self, name):
+        return getattr(self.analyzer, name)
+    
+    def score_matrix(self, texts: List[str]) -> np.ndarray:
+        """Queue texts for batched scoring and wait for their probability rows."""
+        futures = []
+        for text in texts:
+            future = Future()
+            self._queue.put((text, future))
+            futures.append(future)
+        if not futures:
+            return np.zeros((0, len(self.analyzer._labels)))
+        return np.stack([future.result() for future in futures])
+    
+    def analyze(self, texts: List[str]) -> List[Mapping]:
+        return self.analyzer.analyze(texts, score_fn=self.score_matrix)
+    
+    def get_aggregate_emotions(self, texts: List[str], detail_limit: Optional[int] = None) -> Dict[str, Any]:
+        return self.analyzer.get_aggregate_emotions(texts, score_fn=self.score_matrix, detail_limit=detail_limit)
+    
+    def close(self):
+        """Stop the worker once queued texts are scored."""
+        self._queue.put(None)
+        self._worker.join()
+    
+    def _drain(self):
+        """Block for one item, then gather more until the batch is full or the window closes."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        items = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch, stop on the next drain
+                self._queue.put(None)
+                break
+            items.append(item)
+        return items
+    
+    def _run(self):
+        while True:
+            items = self._drain()
+            if items is None:
+                return
+            items.sort(key=lambda item: len(item[0]))
+            try:
+                scores = self.analyzer.score_matrix([text for text, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), row in zip(items, scores):
+                future.set_result(row)
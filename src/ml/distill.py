@@ -0,0 +1,133 @@
+"""
+Distill the DistilRoBERTa emotion model into a BERT-Mini student.
+
+Run with ``python -m src.ml.distill``. The student is saved to
+models/emotion_mini (picked up automatically by EmotionAnalyzer) and
+exported to models/emotion_mini.onnx for inference and EZKL.
+"""
+import argparse
+import logging
+import torch
+import torch.nn.functional as F
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from src.ml.sentiment import EmotionAnalyzer, TEACHER_MODEL, STUDENT_MODEL_DIR, STUDENT_ONNX_PATH, MAX_LENGTH
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+STUDENT_BASE = "prajjwal1/bert-mini"
+# Unlabelled English text is enough: the student learns the teacher's logits
+DATASET = "dair-ai/emotion"
+
+
+def load_texts(dataset_name=DATASET, split="train"):
+    """Load the training texts used for distillation."""
+    from datasets import load_dataset
+    return list(load_dataset(dataset_name, split=split)["text"])
+
+
+def distillation_loss(student_logits, teacher_logits, temperature):
+    """KL divergence between temperature-softened teacher and student outputs."""
+    return F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=-1),
+        F.softmax(teacher_logits / temperature, dim=-1),
+        reduction="batchmean",
+    ) * temperature ** 2
+
+
+def distill(texts, student_base=STUDENT_BASE, output_dir=STUDENT_MODEL_DIR,
+            epochs=3, batch_size=32, lr=5e-5, temperature=2.0):
+    """
+    Train a student to match the teacher's emotion logits on texts.
+
+    Args:
+        texts: Training texts
+        student_base: Pretrained encoder the student starts from
+        output_dir: Where the student model and tokenizer are saved
+        epochs: Passes over texts
+        batch_size: Texts per optimizer step
+        lr: AdamW learning rate
+        temperature: Softmax temperature for the distillation loss
+
+    Returns:
+        output_dir
+    """
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    teacher_tokenizer = AutoTokenizer.from_pretrained(TEACHER_MODEL)
+    teacher = AutoModelForSequenceClassification.from_pretrained(TEACHER_MODEL).to(device).eval()
+
+    # Reuse the teacher's label mapping so the student's outputs line up
+    student_tokenizer = AutoTokenizer.from_pretrained(student_base)
+    student = AutoModelForSequenceClassification.from_pretrained(
+        student_base,
+        num_labels=teacher.config.num_labels,
+        id2label=teacher.config.id2label,
+        label2id=teacher.config.label2id,
+    ).to(device)
+
+    optimizer = torch.optim.AdamW(student.parameters(), lr=lr)
+
+    for epoch in range(epochs):
+        student.train()
+        order = torch.randperm(len(texts)).tolist()
+        total_loss = 0.0
+        for start in range(0, len(order), batch_size):
+            batch = [texts[i] for i in order[start:start + batch_size]]
+
+            teacher_inputs = teacher_tokenizer(batch, return_tensors="pt", padding=True,
+                                               truncation=True, max_length=MAX_LENGTH).to(device)
+            with torch.no_grad():
+                teacher_logits = teacher(**teacher_inputs).logits
+
+            student_inputs = student_tokenizer(batch, return_tensors="pt", padding=True,
+                                               truncation=True, max_length=MAX_LENGTH).to(device)
+            student_logits = student(**student_inputs).logits
+
+            loss = distillation_loss(student_logits, teacher_logits, temperature)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(batch)
+
+        logging.info(f"Epoch {epoch + 1}/{epochs}: distillation loss {total_loss / len(texts):.4f}")
+
+    student.save_pretrained(output_dir)
+    student_tokenizer.save_pretrained(output_dir)
+    logging.info(f"Student model saved to {output_dir}")
+    return output_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distill the emotion model into a smaller student')
+    parser.add_argument('--student-base', default=STUDENT_BASE, help='Pretrained encoder for the student')
+    parser.add_argument('--dataset', default=DATASET, help='Hugging Face dataset providing training texts')
+    parser.add_argument('--epochs', type=int, default=3, help='Training epochs')
+    parser.add_argument('--batch-size', type=int, default=32, help='Training batch size')
+    parser.add_argument('--lr', type=float, default=5e-5, help='Learning rate')
+    parser.add_argument('--temperature', type=float, default=2.0, help='Distillation temperature')
+    parser.add_argument('--output-dir', default=STUDENT_MODEL_DIR, help='Where to save the student model')
+    parser.add_argument('--onnx-path', default=STUDENT_ONNX_PATH, help='Where to export the student ONNX model')
+
+    args = parser.parse_args()
+
+    texts = load_texts(args.dataset)
+    output_dir = distill(
+        texts,
+        student_base=args.student_base,
+        output_dir=args.output_dir,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        lr=args.lr,
+        temperature=args.temperature,
+    )
+
+    onnx_path = EmotionAnalyzer(model_name=output_dir).export_to_onnx(args.onnx_path)
+    if onnx_path:
+        logging.info(f"Student model exported to {onnx_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,229 @@
-from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
-import torch
-import onnx
 import numpy as np
 import logging
 import os
 import json
-from typing import List, Dict, Any, Tuple
+import hashlib
+import inspect
+import threading
+from collections import deque
+from collections.abc import Mapping
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple, Optional, Callable
+from src.utils.cpu_features import has_cpu_flag
+
+# torch, transformers and onnx are imported where they are used so that
+# importing this module (e.g. for resolve_model) stays cheap.
+
+try:
+    import onnxruntime as ort
+except ImportError:  # ONNX Runtime is optional; analyze() falls back to transformers
+    ort = None
+
+try:
+    import diskcache
+except ImportError:  # Score caching is optional
+    diskcache = None
+
+# Full-size emotion model and where its ONNX export lives
+TEACHER_MODEL = "j-hartmann/emotion-english-distilroberta-base"
+DEFAULT_ONNX_PATH = "models/emotion_model.onnx"
+# Distilled student written by src/ml/distill.py, preferred when present
+STUDENT_MODEL_DIR = "models/emotion_mini"
+STUDENT_ONNX_PATH = "models/emotion_mini.onnx"
+# Token limit used for inference and export
+MAX_LENGTH = 128
+# Upper token bounds of the padding buckets used for inference
+LENGTH_BUCKETS = (32, 64, MAX_LENGTH)
+# Supported values for EmotionAnalyzer(quantize=...)
+QUANTIZE_MODES = (None, "int8")
+# Supported values for export_to_onnx(precision=...)
+PRECISIONS = (None, "fp16")
+# Number of representative texts used for static quantization calibration
+CALIBRATION_SIZE = 100
+# On-disk cache of per-post emotion scores, shared across runs
+SCORE_CACHE_DIR = "results/.emotion_cache"
+
+
+def _variant_path(onnx_path: str, tag: str) -> str:
+    """Path of a derived model next to onnx_path, e.g. emotion_model.<tag>.onnx."""
+    root, ext = os.path.splitext(onnx_path)
+    return f"{root}.{tag}{ext}"
+
+
+# Tags of the models derived from an export (see _variant_path)
+VARIANT_TAGS = ("opt", "int8", "int8-dynamic", "fp16")
+
+
+def _fresh_variant(onnx_path: str, tag: str) -> Optional[str]:
+    """Path of a derived model, or None if it is missing or older than the export it came from."""
+    path = _variant_path(onnx_path, tag)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(onnx_path):
+            return path
+    except OSError:
+        pass
+    return None
+
+
+def resolve_model(use_teacher: bool = False) -> Tuple[str, str]:
+    """
+    Pick the default emotion model and its ONNX path.
+    
+    The distilled student is used when it has been trained, unless the
+    full-size teacher is explicitly requested.
+    """
+    if not use_teacher and os.path.isdir(STUDENT_MODEL_DIR):
+        return STUDENT_MODEL_DIR, STUDENT_ONNX_PATH
+    return TEACHER_MODEL, DEFAULT_ONNX_PATH
+
+
+def _cuda_provider_available() -> bool:
+    """Whether ONNX Runtime can run on a CUDA GPU here."""
+    return ort is not None and "CUDAExecutionProvider" in ort.get_available_providers()
+
+
+@lru_cache(maxsize=4)
+def _load_hf_tokenizer(model_name: str):
+    """Tokenizer for model_name, loaded once per process."""
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+@lru_cache(maxsize=4)
+def _load_hf_model(model_name: str):
+    """
+    Sequence classification model for model_name in eval mode, loaded once per
+    process and shared by every analyzer using it (e.g. FP32 and INT8 variants).
+    """
+    from transformers import AutoModelForSequenceClassification
+    return AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+
+
+def _forward_args(model, inputs: Dict[str, Any]) -> Tuple[Tuple[Any, ...], List[str]]:
+    """
+    Order tokenizer outputs as model.forward's positional parameters.
+    
+    Tokenizers don't emit inputs in forward()'s order (BERT's gives
+    token_type_ids before attention_mask), and torch.onnx.export binds the
+    args tuple by position. Parameters in between that the tokenizer doesn't
+    produce are passed as None.
+    
+    Returns:
+        Tuple of (args for torch.onnx.export, graph input names in that order)
+    """
+    args, names = [], []
+    remaining = set(inputs)
+    for name in inspect.signature(model.forward).parameters:
+        if not remaining:
+            break
+        if name in remaining:
+            args.append(inputs[name])
+            names.append(name)
+            remaining.discard(name)
+        else:
+            args.append(None)
+    if remaining:
+        raise ValueError(f"model.forward doesn't accept inputs: {sorted(remaining)}")
+    return tuple(args), names
+
+
+def _intra_op_threads() -> int:
+    """Intra-op threads for PyTorch and ONNX Runtime: one per physical core."""
+    # Hyperthread siblings share the FMA units, so they don't speed up GEMMs
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+# ONNX Runtime sessions shared by every analyzer in the process, keyed by
+# (model file, providers) and rebuilt only when the file changes
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def _shared_session(model_path: str, providers: List[Any]):
+    """Return the process-wide InferenceSession for model_path, creating it once."""
+    key = (model_path, repr(providers))
+    mtime = os.path.getmtime(model_path)
+    with _SESSIONS_LOCK:
+        cached = _SESSIONS.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        if not _SESSIONS:
+            # One CPU arena for all sessions instead of one per session
+            try:
+                ort.create_and_register_allocator(
+                    ort.OrtMemoryInfo("Cpu", ort.OrtAllocatorType.ORT_ARENA_ALLOCATOR, 0, ort.OrtMemType.DEFAULT),
+                    None,
+                )
+            except Exception as e:
+                logging.debug("Shared ONNX Runtime allocator unavailable: %s", e)
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = _intra_op_threads()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        so.enable_mem_pattern = True
+        so.enable_cpu_mem_arena = True
+        so.add_session_config_entry("session.use_env_allocators", "1")
+        session = ort.InferenceSession(model_path, sess_options=so, providers=providers)
+        _SESSIONS[key] = (mtime, session)
+        logging.info(f"Using ONNX Runtime session for {model_path}")
+        return session
+
+
+def _configure_torch_threads():
+    """Run PyTorch intra-op work on physical cores only and keep one inter-op thread."""
+    import torch
+    torch.set_num_threads(_intra_op_threads())
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only allowed before any inter-op work has started in this process
+        pass
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    """Row-wise softmax over a (N, num_labels) logits matrix."""
+    # One temporary, then exponentiate and normalize in place
+    exp = logits - logits.max(axis=-1, keepdims=True)
+    np.exp(exp, out=exp)
+    exp /= exp.sum(axis=-1, keepdims=True)
+    return exp
+
+class _EmotionRow(Mapping):
+    """
+    One analyze() result, read like a dict with 'emotions', 'dominant_emotion'
+    and 'dominant_score'.
+    
+    Holds a view of the score matrix row; the per-emotion dict is only built
+    if 'emotions' is actually read.
+    """
+    
+    __slots__ = ('_labels', '_scores', '_idx', '_score')
+    _KEYS = ('emotions', 'dominant_emotion', 'dominant_score')
+    
+    def __init__(self, labels, scores, idx, score):
+        self._labels = labels
+        self._scores = scores
+        self._idx = idx
+        self._score = score
+    
+    def __getitem__(self, key):
+        if key == 'emotions':
+            return dict(zip(self._labels, self._scores.tolist()))
+        if key == 'dominant_emotion':
+            return self._labels[self._idx]
+        if key == 'dominant_score':
+            return self._score
+        raise KeyError(key)
+    
+    def __iter__(self):
+        return iter(self._KEYS)
+    
+    def __len__(self):
+        return len(self._KEYS)
+    
+    def __repr__(self):
+        return repr(dict(self))
+
 
 class EmotionAnalyzer:
     """Enhanced emotion analyzer using a more nuanced emotion detection model."""
@@ -20,56 +238,387 @@ class EmotionAnalyzer:
         'anger': '#FF0000',    # Red
         'disgust': '#006400',  # Dark Green
     }
+    # Emotion order used for aggregated results
+    LABELS = tuple(EMOTION_COLORS)
+    # Colors in LABELS order, e.g. for the emotion_counts of get_aggregate_emotions
+    ORDERED_COLORS = tuple(EMOTION_COLORS.values())
     
-    def __init__(self, model_name="j-hartmann/emotion-english-distilroberta-base"):
+    def __init__(self, model_name=None, onnx_path=None, quantize=None, use_teacher=False,
+                 cache_dir=SCORE_CACHE_DIR):
+        """
+        Args:
+            model_name: Hugging Face model id or directory; defaults to resolve_model()
+            onnx_path: Exported ONNX model used for inference; defaults to the
+                resolved model's export when model_name is not given
+            quantize: None or "int8" to run a quantized copy of the ONNX model
+            use_teacher: Load the full-size model even if a distilled student exists
+            cache_dir: Directory of the on-disk score cache, or None to disable it
+        """
+        if model_name is None:
+            model_name, default_onnx_path = resolve_model(use_teacher)
+            onnx_path = onnx_path or default_onnx_path
+        if quantize not in QUANTIZE_MODES:
+            raise ValueError(f"Unsupported quantize mode: {quantize}")
+        if quantize == "int8" and not has_cpu_flag("avx512_vnni"):
+            # INT8 GEMMs only pay off with VNNI dot-product instructions
+            logging.info("CPU lacks AVX512-VNNI, using the FP32 ONNX model")
+            quantize = None
         self.model_name = model_name
+        self.onnx_path = onnx_path
+        self.quantize = quantize
+        self._ort_session = None
+        # Score cache id of the model file behind _ort_session, fixed when it is built
+        self._ort_variant = None
+        # PyTorch module used for scoring when there is no ONNX export
+        self._forward_model = None
+        # Whether that module runs under CPU bfloat16 autocast (IPEX on AMX)
+        self._forward_bf16 = False
+        # Scores of previously seen posts, so repeats skip the forward pass
+        self._score_cache = diskcache.Cache(cache_dir) if diskcache is not None and cache_dir else None
+        # Recently analyzed texts, used to calibrate static quantization
+        self._calibration_texts = deque(maxlen=CALIBRATION_SIZE)
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.model = AutoModelForSequenceClassification.from_pretrained(model_name)
-            self.emotion_pipeline = pipeline(
-                "text-classification",
-                model=self.model,
-                tokenizer=self.tokenizer,
-                return_all_scores=True
-            )
+            self.tokenizer = _load_hf_tokenizer(model_name)
+            self.model = _load_hf_model(model_name)
+            _configure_torch_threads()
+            # Label names in logit column order
+            self._labels = [self.model.config.id2label[i] for i in range(self.model.config.num_labels)]
+            # Logit column of each entry in LABELS
+            self._label_columns = [self._labels.index(emotion) for emotion in self.LABELS]
             logging.info(f"Emotion analysis model {model_name} loaded successfully")
         except Exception as e:
             logging.error(f"Error loading emotion analysis model: {e}")
             raise
 
-    def analyze(self, texts: List[str]) -> List[Dict[str, Any]]:
+    def analyze(self, texts: List[str], score_fn: Optional[Callable] = None) -> List[Mapping]:
         """
         Analyze emotions in a list of texts.
-        Returns a list of dictionaries with scores for each emotion.
+        Returns a list of read-only mappings with scores for each emotion
+        (use dict(result) where a real dict is needed, e.g. for JSON).
+        
+        score_fn replaces score_matrix, e.g. to route through a batching queue.
         """
         if not texts:
             return []
         
         try:
-            results = self.emotion_pipeline(texts)
-            # Format results to be more usable
-            formatted_results = []
-            
-            for item in results:
-                # For a single text, we get a list of dicts with label and score
-                emotion_scores = {emotion['label']: emotion['score'] for emotion in item}
-                # Find the dominant emotion (highest score)
-                dominant_emotion = max(emotion_scores.items(), key=lambda x: x[1])
-                
-                formatted_results.append({
-                    'emotions': emotion_scores,
-                    'dominant_emotion': dominant_emotion[0],
-                    'dominant_score': dominant_emotion[1]
-                })
-                
-            return formatted_results
+            return self._format_scores((score_fn or self.score_matrix)(texts))
         except Exception as e:
             logging.error(f"Error during emotion analysis: {e}")
             return []
 
-    def get_aggregate_emotions(self, texts: List[str]) -> Dict[str, Any]:
+    def score_matrix(self, texts: List[str]) -> np.ndarray:
+        """
+        Emotion probabilities as an (N, num_labels) array in model label order.
+        
+        Rows for texts already in the score cache are reused; only the misses
+        go through the model.
+        """
+        if self._score_cache is None or not texts:
+            return self._compute_scores(texts)
+        
+        variant = self._score_variant()
+        keys = [self._score_key(variant, text) for text in texts]
+        rows = [self._score_cache.get(key) for key in keys]
+        misses = [i for i, row in enumerate(rows) if row is None]
+        if misses:
+            fresh = self._compute_scores([texts[i] for i in misses])
+            for i, row in zip(misses, fresh):
+                self._score_cache.set(keys[i], row)
+                rows[i] = row
+        return np.stack(rows)
+
+    def _score_variant(self) -> str:
+        """Identify the weights that produce scores, so a re-export invalidates the cache."""
+        if self._get_onnx_session() is not None:
+            return self._ort_variant
+        return "transformers"
+
+    def _score_key(self, variant: str, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{variant}\0{text}".encode()).hexdigest()
+
+    def _compute_scores(self, texts: List[str]) -> np.ndarray:
+        """Run the model on texts, preferring the ONNX Runtime session."""
+        session = self._get_onnx_session()
+        if session is not None:
+            return self._onnx_scores(session, texts)
+        
+        # No exported model yet: run the PyTorch model directly
+        import torch
+        model = self._get_forward_model()
+        # Padding to a multiple of the smallest bucket keeps the set of input
+        # shapes small, so a compiled model isn't recompiled for every batch
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True, truncation=True,
+                                max_length=MAX_LENGTH, pad_to_multiple_of=LENGTH_BUCKETS[0])
+        inputs = {name: tensor.to(model.device) for name, tensor in inputs.items()}
+        with torch.inference_mode(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=self._forward_bf16):
+            logits = model(**inputs).logits
+        return _softmax(logits.float().cpu().numpy())
+
+    def _get_forward_model(self):
+        """
+        Return the PyTorch module used for scoring, compiling it on CUDA.
+        
+        On a GPU the model is compiled once with TorchInductor
+        (mode="reduce-overhead"); the first batch pays the compile cost and
+        later ones run the fused kernels. On CPU, Intel Extension for PyTorch
+        is applied when installed, in bfloat16 on CPUs with AMX. Compilation
+        and IPEX return new modules, so self.model keeps its plain weights for
+        ONNX export, but on a GPU it is moved to CUDA in place. That module is
+        shared through _load_hf_model by every analyzer of the same model, and
+        export_to_onnx moves it to the same device anyway.
+        """
+        if self._forward_model is None:
+            import torch
+            model = self.model
+            if torch.cuda.is_available():
+                model = model.to("cuda")
+                if hasattr(torch, "compile"):
+                    model = torch.compile(model, mode="reduce-overhead")
+                    logging.info("Compiled emotion model with torch.compile for CUDA inference")
+            else:
+                try:
+                    import intel_extension_for_pytorch as ipex
+                except ImportError:  # IPEX is optional
+                    ipex = None
+                if ipex is not None:
+                    self._forward_bf16 = has_cpu_flag("amx_bf16")
+                    dtype = torch.bfloat16 if self._forward_bf16 else torch.float32
+                    model = ipex.optimize(model, dtype=dtype)  # returns a copy
+                    logging.info(f"Optimized emotion model with IPEX ({dtype})")
+            self._forward_model = model
+        return self._forward_model
+
+    def _get_onnx_session(self):
+        """Return the ONNX Runtime session once an exported model exists (shared across instances)."""
+        if self._ort_session is None and ort is not None and self.onnx_path and os.path.exists(self.onnx_path):
+            model_path = self._inference_model_path()
+            providers = ['CPUExecutionProvider']
+            # INT8 variants use CPU integer kernels (VNNI) that CUDA lacks
+            int8_paths = (_variant_path(self.onnx_path, "int8"), _variant_path(self.onnx_path, "int8-dynamic"))
+            if _cuda_provider_available() and model_path not in int8_paths:
+                providers.insert(0, ('CUDAExecutionProvider', {'cudnn_conv_use_max_workspace': '1'}))
+            self._ort_session = _shared_session(model_path, providers)
+            self._ort_variant = f"{os.path.basename(model_path)}:{os.path.getmtime(model_path)}"
+        return self._ort_session
+
+    def _inference_model_path(self) -> str:
+        """Pick the ONNX file to run: FP16 on a GPU, int8 (calibrated, else dynamic) when requested, then the fused graph, else the export."""
+        # Variants older than the export belong to earlier weights and are skipped
+        fp16_path = _fresh_variant(self.onnx_path, "fp16")
+        if fp16_path and _cuda_provider_available():
+            return fp16_path
+        # self.quantize is already None on CPUs without VNNI
+        if self.quantize == "int8":
+            static_path = _fresh_variant(self.onnx_path, "int8")
+            if static_path:
+                return static_path
+            quantized_path = (_fresh_variant(self.onnx_path, "int8-dynamic")
+                              or self.quantize_onnx(self.onnx_path, _variant_path(self.onnx_path, "int8-dynamic")))
+            if quantized_path:
+                return quantized_path
+        return _fresh_variant(self.onnx_path, "opt") or self.onnx_path
+
+    def optimize_onnx(self, onnx_path: Optional[str] = None, output_path: Optional[str] = None) -> Optional[str]:
+        """
+        Write a copy of an exported ONNX model with transformer-specific fusions.
+        
+        Attention, LayerNorm/SkipLayerNorm and GELU subgraphs are collapsed into
+        single ONNX Runtime kernels. The fused graph uses ORT contrib ops, so it
+        is written next to the export rather than over it; EZKL keeps using the
+        plain export.
+        """
+        from onnxruntime.transformers.optimizer import optimize_model
+        
+        onnx_path = onnx_path or self.onnx_path
+        output_path = output_path or _variant_path(onnx_path, "opt")
+        try:
+            config = self.model.config
+            optimized = optimize_model(
+                onnx_path,
+                model_type='bert',
+                num_heads=config.num_attention_heads,
+                hidden_size=config.hidden_size,
+            )
+            optimized.save_model_to_file(output_path)
+            logging.info(f"Optimized model written to {output_path}")
+            return output_path
+        except Exception as e:
+            logging.error(f"Error optimizing ONNX model: {e}")
+            return None
+
+    def quantize_onnx(self, onnx_path: Optional[str] = None, output_path: Optional[str] = None) -> Optional[str]:
+        """
+        Write a dynamically INT8-quantized copy of an exported ONNX model.
+        
+        Dynamic quantization needs no calibration data: weights are stored as
+        int8 and activations are quantized on the fly at inference time.
+        """
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        
+        onnx_path = onnx_path or self.onnx_path
+        output_path = output_path or _variant_path(onnx_path, "int8-dynamic")
+        try:
+            quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QInt8)
+            logging.info(f"Quantized model written to {output_path}")
+            return output_path
+        except Exception as e:
+            logging.error(f"Error quantizing ONNX model: {e}")
+            return None
+
+    def convert_onnx_fp16(self, onnx_path: Optional[str] = None, output_path: Optional[str] = None) -> Optional[str]:
+        """
+        Write an FP16 copy of an exported ONNX model for GPU inference.
+        
+        Halving the weight and activation bytes roughly doubles effective memory
+        bandwidth on CUDA. Inputs and outputs stay int64/float32 so callers are
+        unchanged.
+        """
+        import onnx
+        from onnxruntime.transformers.float16 import convert_float_to_float16
+        
+        onnx_path = onnx_path or self.onnx_path
+        output_path = output_path or _variant_path(onnx_path, "fp16")
+        try:
+            onnx.save(convert_float_to_float16(onnx.load(onnx_path), keep_io_types=True), output_path)
+            logging.info(f"FP16 model written to {output_path}")
+            return output_path
+        except Exception as e:
+            logging.error(f"Error converting ONNX model to FP16: {e}")
+            return None
+
+    def _onnx_scores(self, session, texts: List[str]) -> np.ndarray:
+        """
+        Score texts with ONNX Runtime, returning (N, num_labels) probabilities.
+        
+        Texts are grouped into token-length buckets and each bucket is padded
+        only to its own longest text, so short posts don't pay for 128 tokens.
+        """
+        input_names = [inp.name for inp in session.get_inputs()]
+        on_gpu = 'CUDAExecutionProvider' in session.get_providers()
+        encoded = self.tokenizer(texts, truncation=True, max_length=MAX_LENGTH)
+        lengths = np.fromiter((len(ids) for ids in encoded["input_ids"]), dtype=np.int64, count=len(texts))
+        bucket_ids = np.searchsorted(LENGTH_BUCKETS, lengths)
+        
+        scores = None
+        for bucket in np.unique(bucket_ids):
+            rows = np.flatnonzero(bucket_ids == bucket)
+            batch = self.tokenizer.pad(
+                {name: [encoded[name][i] for i in rows] for name in input_names}, return_tensors="np"
+            )
+            feeds = {name: batch[name].astype(np.int64) for name in input_names}
+            logits = self._run_session(session, feeds) if on_gpu else session.run(None, feeds)[0]
+            if scores is None:
+                scores = np.empty((len(texts), logits.shape[1]), dtype=logits.dtype)
+            # Scatter back into the caller's order
+            scores[rows] = _softmax(logits)
+        return scores
+
+    @staticmethod
+    def _run_session(session, feeds: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Run a GPU session through IO binding.
+        
+        Inputs are copied to the device once and the logits are written
+        straight into host memory, instead of going through session.run's
+        intermediate buffers.
+        """
+        binding = session.io_binding()
+        for name, array in feeds.items():
+            binding.bind_cpu_input(name, array)
+        output_name = session.get_outputs()[0].name
+        binding.bind_output(output_name, 'cpu')
+        session.run_with_iobinding(binding)
+        return binding.copy_outputs_to_cpu()[0]
+
+    def _format_scores(self, scores: np.ndarray) -> List[Mapping]:
+        """Wrap a probability matrix in the per-text results returned by analyze()."""
+        dominant = scores.argmax(axis=1).tolist()
+        dominant_scores = scores[np.arange(len(scores)), dominant].tolist()
+        labels = self._labels
+        return [
+            _EmotionRow(labels, row, idx, score)
+            for row, idx, score in zip(scores, dominant, dominant_scores)
+        ]
+
+    def calibrate(self, texts: Optional[List[str]] = None, save_dir: Optional[str] = None) -> Optional[str]:
+        """
+        Produce a statically INT8-quantized model calibrated on representative texts.
+        
+        Activation ranges are measured offline (min/max over the calibration set),
+        so inference runs int8 end to end. Once written, analyzers with
+        quantize="int8" prefer it.
+        
+        Args:
+            texts: Calibration texts; defaults to recently analyzed posts
+            save_dir: Directory for the quantized model; defaults to the export's
+        
+        Returns:
+            Path to the quantized model, or None on failure
+        """
+        import onnx
+        from onnxruntime.quantization import (
+            quantize_static, CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType
+        )
+        
+        texts = list(texts if texts is not None else self._calibration_texts)[:CALIBRATION_SIZE]
+        if not texts:
+            logging.error("No texts available for calibration")
+            return None
+        if not self.onnx_path or not os.path.exists(self.onnx_path):
+            logging.error(f"Cannot calibrate: model file doesn't exist at {self.onnx_path}")
+            return None
+        
+        output_path = _variant_path(self.onnx_path, "int8")
+        if save_dir:
+            output_path = os.path.join(save_dir, os.path.basename(output_path))
+        
+        # Same fixed-length encoding the ONNX export uses
+        encoded = self.tokenizer(texts, return_tensors="np", padding="max_length", truncation=True, max_length=MAX_LENGTH)
+        # Feed exactly the inputs the graph declares (e.g. BERT's token_type_ids)
+        input_names = [inp.name for inp in onnx.load(self.onnx_path, load_external_data=False).graph.input]
+        missing = [name for name in input_names if name not in encoded]
+        if missing:
+            logging.error(f"Cannot calibrate: tokenizer doesn't produce model inputs {missing}")
+            return None
+        
+        class _Reader(CalibrationDataReader):
+            def __init__(self):
+                self._rows = iter(range(len(texts)))
+            
+            def get_next(self):
+                i = next(self._rows, None)
+                if i is None:
+                    return None
+                return {name: encoded[name][i:i + 1].astype(np.int64) for name in input_names}
+        
+        try:
+            quantize_static(
+                self.onnx_path,
+                output_path,
+                _Reader(),
+                quant_format=QuantFormat.QDQ,
+                per_channel=True,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                calibrate_method=CalibrationMethod.MinMax
+            )
+        except Exception as e:
+            logging.error(f"Error during static quantization: {e}")
+            return None
+        
+        logging.info(f"Calibrated int8 model written to {output_path} ({len(texts)} texts)")
+        self._ort_session = None
+        return output_path
+
+    def get_aggregate_emotions(self, texts: List[str], score_fn: Optional[Callable] = None,
+                               detail_limit: Optional[int] = None,
+                               scores: Optional[np.ndarray] = None) -> Dict[str, Any]:
         """
         Get aggregate emotions for a list of texts.
+        score_fn replaces score_matrix, as in analyze().
+        scores is an already computed score_matrix for texts (in the same order), e.g. scored batch by batch.
+        detail_limit caps emotions_data to the first texts that are actually shown.
         Returns:
         - overall_emotion: dominant emotion across all texts
         - emotion_counts: counts of each emotion category
@@ -78,44 +627,44 @@ class EmotionAnalyzer:
         if not texts:
             return {
                 'overall_emotion': 'neutral',
-                'emotion_counts': {emotion: 0 for emotion in self.EMOTION_COLORS.keys()},
-                'emotion_scores': {emotion: 0 for emotion in self.EMOTION_COLORS.keys()},
+                'emotion_counts': {emotion: 0 for emotion in self.LABELS},
+                'emotion_scores': {emotion: 0 for emotion in self.LABELS},
                 'emotions_data': []
             }
         
-        results = self.analyze(texts)
+        self._calibration_texts.extend(texts)
+        if scores is None:
+            try:
+                scores = (score_fn or self.score_matrix)(texts)
+            except Exception as e:
+                logging.error(f"Error during emotion analysis: {e}")
+                scores = np.zeros((0, len(self._labels)))
         
-        # Count emotions and collect scores
-        emotion_counts = {emotion: 0 for emotion in self.EMOTION_COLORS.keys()}
-        emotion_scores_sum = {emotion: 0.0 for emotion in self.EMOTION_COLORS.keys()}
-        emotion_data = []
+        # Reorder columns to LABELS so counts/averages line up with the colors
+        scores = scores[:, self._label_columns]
+        dominant = scores.argmax(axis=1)
+        counts = np.bincount(dominant, minlength=len(self.LABELS))
+        averages = scores.sum(axis=0) / len(texts)
         
-        for result in results:
-            # Update the dominant emotion count
-            dominant_emotion = result['dominant_emotion']
-            emotion_counts[dominant_emotion] += 1
-            
-            # Sum up scores for each emotion
-            for emotion, score in result['emotions'].items():
-                emotion_scores_sum[emotion] += score
-            
-            # Store individual emotion data for visualization
-            emotion_data.append({
-                'text_snippet': texts[results.index(result)][:100] + ('...' if len(texts[results.index(result)]) > 100 else ''),
-                'emotions': result['emotions'],
-                'dominant_emotion': dominant_emotion
-            })
-        
-        # Calculate average scores
-        emotion_scores_avg = {
-            emotion: score / len(texts) 
-            for emotion, score in emotion_scores_sum.items()
-        }
+        # Convert to Python numbers in one tolist() per array instead of per element
+        emotion_counts = dict(zip(self.LABELS, counts.tolist()))
+        emotion_scores_avg = dict(zip(self.LABELS, averages.tolist()))
+        
+        # Store individual emotion data for visualization
+        shown = texts[:detail_limit]
+        rows = scores[:len(shown)].tolist()
+        dominant_labels = [self.LABELS[idx] for idx in dominant[:len(shown)].tolist()]
+        emotion_data = [
+            {
+                'text_snippet': text[:100] + '...' if len(text) > 100 else text,
+                'emotions': dict(zip(self.LABELS, row)),
+                'dominant_emotion': label
+            }
+            for text, row, label in zip(shown, rows, dominant_labels)
+        ]
         
         # Determine overall dominant emotion
-        overall_emotion = max(emotion_counts.items(), key=lambda x: x[1])[0]
-        if emotion_counts[overall_emotion] == 0:
-            overall_emotion = 'neutral'
+        overall_emotion = self.LABELS[int(counts.argmax())] if counts.any() else 'neutral'
             
         return {
             'overall_emotion': overall_emotion,
@@ -124,8 +673,31 @@ class EmotionAnalyzer:
             'emotions_data': emotion_data
         }
     
-    def export_to_onnx(self, output_path="model.onnx") -> str:
-        """Export the model to ONNX format for use with ezKL."""
+    def _check_export(self, onnx_path: str, encoded_inputs: Dict[str, Any]) -> bool:
+        """Check that ONNX Runtime reproduces the PyTorch logits for an export."""
+        import torch
+        with torch.inference_mode():
+            expected = self.model(**encoded_inputs).logits.float().cpu().numpy()
+        session = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+        feeds = {inp.name: encoded_inputs[inp.name].cpu().numpy() for inp in session.get_inputs()}
+        actual = session.run(None, feeds)[0]
+        if not np.allclose(actual, expected, atol=1e-3):
+            logging.error(f"ONNX export {onnx_path} doesn't match the PyTorch model "
+                          f"(max logit difference {np.abs(actual - expected).max():.4g})")
+            return False
+        return True
+
+    def export_to_onnx(self, output_path="model.onnx", precision=None) -> str:
+        """
+        Export the model to ONNX format for use with ezKL.
+        
+        precision="fp16" additionally writes a half-precision copy that
+        analyze() uses when a CUDA GPU is available.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision: {precision}")
+        import torch
+        import onnx
         try:
             # Create directory for model
             os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
@@ -141,8 +713,8 @@ class EmotionAnalyzer:
             encoded_inputs = tokenizer(dummy_text, return_tensors="pt", padding="max_length", max_length=128)
             encoded_inputs = {k: v.to(device) for k, v in encoded_inputs.items()}
             
-            # Set up export parameters
-            input_names = list(encoded_inputs.keys())
+            # Set up export parameters; the args tuple is bound by position
+            export_args, input_names = _forward_args(model, encoded_inputs)
             dynamic_axes = {}
             for input_name in input_names:
                 dynamic_axes[input_name] = {0: "batch_size", 1: "sequence_length"}
@@ -151,12 +723,15 @@ class EmotionAnalyzer:
             # Export the model
             torch.onnx.export(
                 model,
-                tuple(encoded_inputs.values()),
+                export_args,
                 output_path,
                 input_names=input_names,
                 output_names=["output"],
                 dynamic_axes=dynamic_axes,
                 do_constant_folding=True,
+                # This file is the EZKL circuit input, so it stays on the opset
+                # EZKL is known to compile; optimize_onnx fuses the decomposed
+                # LayerNorm for ORT inference anyway
                 opset_version=14,
                 export_params=True
             )
@@ -173,9 +748,32 @@ class EmotionAnalyzer:
             
             # Verify the export
             onnx.checker.check_model(onnx.load(output_path))
+            if ort is not None and not self._check_export(output_path, encoded_inputs):
+                return None
             logging.info(f"Model exported to {output_path}")
             
+            # Refresh derived models and make analyze() pick up the new export;
+            # variants not regenerated here would hold the previous weights
+            for tag in VARIANT_TAGS:
+                stale_path = _variant_path(output_path, tag)
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+            if ort is not None:
+                self.optimize_onnx(output_path)
+            if self.quantize == "int8":
+                self.quantize_onnx(output_path)
+            if precision == "fp16":
+                self.convert_onnx_fp16(output_path)
+            self._ort_session = None
+            
             return output_path
         except Exception as e:
             logging.error(f"Error exporting model to ONNX: {e}")
             return None
+
+
+@lru_cache(maxsize=None)
+def get_emotion_analyzer(quantize=None, use_teacher=False) -> EmotionAnalyzer:
+    """Return the process-wide EmotionAnalyzer for these settings, loading it once."""
+    return EmotionAnalyzer(quantize=quantize, use_teacher=use_teacher)
+
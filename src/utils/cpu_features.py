@@ -0,0 +1,23 @@
+import logging
+from functools import lru_cache
+
+try:
+    import cpuinfo
+except ImportError:  # py-cpuinfo is optional; without it no feature is reported
+    cpuinfo = None
+
+@lru_cache(maxsize=1)
+def cpu_flags():
+    """Return the host CPU feature flags (e.g. 'avx512_vnni'), empty if unknown."""
+    if cpuinfo is None:
+        logging.debug("py-cpuinfo not installed, CPU feature detection disabled")
+        return frozenset()
+    try:
+        return frozenset(cpuinfo.get_cpu_info().get('flags', []))
+    except Exception as e:
+        logging.warning(f"Could not read CPU feature flags: {e}")
+        return frozenset()
+
+def has_cpu_flag(flag):
+    """Check whether the host CPU advertises the given feature flag."""
+    return flag in cpu_flags()
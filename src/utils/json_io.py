@@ -0,0 +1,59 @@
+import json
+import os
+import tempfile
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; falls back to the stdlib encoder
+    orjson = None
+
+
+def _default(obj):
+    """Let the stdlib encoder handle NumPy arrays and scalars."""
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_json(data, indent=False):
+    """
+    Serialize data (which may contain NumPy arrays) to JSON bytes.
+
+    With orjson, arrays are encoded natively instead of via tolist(); arrays
+    it can't encode natively (non-contiguous, other dtypes) go through
+    tolist() as before.
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=option)
+    return json.dumps(data, default=_default, indent=2 if indent else None).encode()
+
+
+def write_json(path, data, indent=False):
+    """
+    Atomically write data as JSON to path.
+
+    The file is written next to path and renamed into place, so readers such
+    as ezkl never see a half-written file.
+    """
+    payload = dumps_json(data, indent=indent)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+def read_json(path):
+    """Read a JSON file written by write_json (or anything else)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
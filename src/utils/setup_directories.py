@@ -1,25 +1,26 @@
-import os
 import logging
+from functools import lru_cache
+from pathlib import Path
 
+# Project root, two levels above src/utils
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+@lru_cache(maxsize=1)
 def setup_directories():
-    """Set up necessary directories using absolute paths."""
-    # Get the absolute path to the project root
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(os.path.dirname(script_dir))  # Go up two levels
-    
+    """Set up necessary directories using absolute paths (only once per process)."""
     # Define absolute paths for all required directories
-    models_dir = os.path.join(project_root, "models")
-    ezkl_dir = os.path.join(project_root, "ezkl_files")
-    results_dir = os.path.join(project_root, "results")
-    
+    models_dir = PROJECT_ROOT / "models"
+    ezkl_dir = PROJECT_ROOT / "ezkl_files"
+    results_dir = PROJECT_ROOT / "results"
+
     # Create directories if they don't exist
-    for directory in [models_dir, ezkl_dir, results_dir]:
-        os.makedirs(directory, exist_ok=True)
-        logging.info(f"Ensured directory exists: {directory}")
-    
+    for directory in (models_dir, ezkl_dir, results_dir):
+        directory.mkdir(parents=True, exist_ok=True)
+        logging.debug("Ensured directory exists: %s", directory)
+
     return {
-        'models_dir': models_dir,
-        'ezkl_dir': ezkl_dir,
-        'results_dir': results_dir,
-        'project_root': project_root
-    }
\ No newline at end of file
+        'models_dir': str(models_dir),
+        'ezkl_dir': str(ezkl_dir),
+        'results_dir': str(results_dir),
+        'project_root': str(PROJECT_ROOT)
+    }
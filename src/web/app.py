@@ -1,20 +1,23 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, render_template, request, session
 import os
 import sys
 import logging
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
-import base64
-from io import BytesIO
-import json
+import re
+import hashlib
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional, Tuple
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from src.api.bluesky import BlueskyAPI
-from src.ml.sentiment import EmotionAnalyzer
-from src.zk.ezkl_integration import EZKLIntegrator  # Updated import path
+from src.ml.sentiment import MAX_LENGTH, get_emotion_analyzer
+from src.ml.batching import BatchingEmotionAnalyzer
+from src.zk.ezkl_integration import EZKLIntegrator, make_proof_executor, run_proof, work_path  # Updated import path
+from src.utils.json_io import dumps_json, write_json
 
 # Ensure directories exist
 os.makedirs("models", exist_ok=True)
@@ -25,15 +28,191 @@ app = Flask(__name__,
            static_url_path='/static',
            static_folder='static')
 app.secret_key = os.urandom(24)
-app.config['SESSION_TYPE'] = 'filesystem'
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize components
-emotion_analyzer = EmotionAnalyzer()
-ezkl_integrator = EZKLIntegrator(model_path="models/emotion_model.onnx")
+# Any character str.isalnum() rejects; replaced with a space in proof inputs
+_NON_ALNUM = re.compile(r'[\W_]')
+
+# Characters of each post kept for proof inputs; the tokenizer truncates to
+# MAX_LENGTH tokens anyway, and a token covers about four characters
+PROOF_INPUT_CHARS = 4 * MAX_LENGTH
+
+# Posts the UI shows per-post emotions for (sample list and breakdown chart)
+DETAIL_POSTS = 10
+
+# Emotion analyzer, EZKL integrator and proof pool, built by get_components().
+# Spawned proof workers re-import this module (and the script that started
+# the server), so nothing heavy may happen at import time.
+_components = None
+_components_lock = threading.Lock()
+
+def get_components():
+    """
+    Return (emotion_analyzer, ezkl_integrator, proof_executor), building them once.
+    
+    Concurrent requests share the analyzer's forward passes. Proving runs in
+    separate processes so it never holds this process's GIL; one worker per
+    GPU, so proofs run concurrently on multi-GPU hosts while preprocessing for
+    the next request continues here.
+    """
+    global _components
+    with _components_lock:
+        if _components is None:
+            emotion_analyzer = BatchingEmotionAnalyzer(get_emotion_analyzer())
+            ezkl_integrator = EZKLIntegrator(model_path=emotion_analyzer.onnx_path)
+            _components = (emotion_analyzer, ezkl_integrator, make_proof_executor())
+        return _components
+
+# Seconds an analysis stays available for proof generation
+ANALYSIS_TTL = 600
+
+# Analysis results by id; the session cookie only carries the id
+_analyses = {}
+_analyses_lock = threading.Lock()
+
+def store_analysis(data):
+    """Keep an analysis in memory for ANALYSIS_TTL seconds and return its id."""
+    analysis_id = uuid.uuid4().hex
+    now = time.monotonic()
+    with _analyses_lock:
+        for stale in [k for k, (expiry, _) in _analyses.items() if expiry <= now]:
+            del _analyses[stale]
+        _analyses[analysis_id] = (now + ANALYSIS_TTL, data)
+    return analysis_id
+
+def load_analysis(analysis_id):
+    """Return a stored analysis, or None if it is unknown or expired."""
+    with _analyses_lock:
+        entry = _analyses.get(analysis_id)
+    if entry is None or entry[0] <= time.monotonic():
+        return None
+    return entry[1]
+
+# Seconds a finished proof's result waits to be polled before it is dropped
+PROOF_RESULT_TTL = 600
+
+# Background proof jobs by id, polled through /proof_status/<job_id>:
+# job id -> (future, expiry); the expiry is set once the job finishes
+_proof_jobs = {}
+_proof_jobs_lock = threading.Lock()
+
+def store_proof_job(job_id, future, replaces=None):
+    """
+    Track a submitted proof job, dropping finished jobs nobody polled in time.
+    
+    replaces is the session's previous job, which it can no longer poll.
+    """
+    now = time.monotonic()
+    with _proof_jobs_lock:
+        for stale in [k for k, (_, expiry) in _proof_jobs.items() if expiry <= now]:
+            del _proof_jobs[stale]
+        _proof_jobs.pop(replaces, None)
+        _proof_jobs[job_id] = (future, float('inf'))
+    # Registered outside the lock: it runs right away if the job is already done
+    future.add_done_callback(lambda _: _proof_job_finished(job_id))
+
+def _proof_job_finished(job_id):
+    """Start the expiry clock of a finished proof job."""
+    with _proof_jobs_lock:
+        entry = _proof_jobs.get(job_id)
+        if entry is not None:
+            _proof_jobs[job_id] = (entry[0], time.monotonic() + PROOF_RESULT_TTL)
+
+# Seconds a logged-in Bluesky client is reused before its login is refreshed
+BLUESKY_SESSION_TTL = 30 * 60
+
+# BlueskyAPI clients shared across requests: None -> anonymous client,
+# credential digest -> (client, expiry)
+_bluesky_clients = {}
+_bluesky_clients_lock = threading.Lock()
+
+def get_bluesky_api(username=None, password=None):
+    """
+    Return a shared BlueskyAPI for the given credentials.
+    
+    Logins are reused until BLUESKY_SESSION_TTL passes, so only the first
+    request per account pays the authentication round-trip.
+    
+    Returns:
+        BlueskyAPI instance, or None if the login failed
+    """
+    if not (username and password):
+        with _bluesky_clients_lock:
+            if None not in _bluesky_clients:
+                _bluesky_clients[None] = (BlueskyAPI(), float('inf'))
+            return _bluesky_clients[None][0]
+    
+    key = hashlib.blake2b(f"{username}:{password}".encode()).hexdigest()
+    now = time.monotonic()
+    with _bluesky_clients_lock:
+        entry = _bluesky_clients.get(key)
+    if entry is not None and now < entry[1]:
+        return entry[0]
+    
+    # New account or expired login: authenticate a fresh client outside the
+    # lock, so a client being evicted is never the one logging in
+    bluesky_api = BlueskyAPI()
+    if not bluesky_api.login(username, password):
+        bluesky_api.close()
+        with _bluesky_clients_lock:
+            failed = _bluesky_clients.pop(key, None)
+        if failed is not None:
+            failed[0].close()
+        return None
+    
+    now = time.monotonic()
+    with _bluesky_clients_lock:
+        current = _bluesky_clients.get(key)
+        if current is not None and now < current[1]:
+            # Another request refreshed this login meanwhile; use that one
+            winner, evicted = current[0], [bluesky_api]
+        else:
+            # Drop expired logins (this one's included) so the cache doesn't
+            # grow without bound
+            winner = bluesky_api
+            evicted = [_bluesky_clients.pop(k)[0]
+                       for k in [k for k, (_, expiry) in _bluesky_clients.items() if expiry <= now]]
+            _bluesky_clients[key] = (bluesky_api, now + BLUESKY_SESSION_TTL)
+    # Evicted clients hold HTTP pools and search threads; release them
+    for client in evicted:
+        client.close()
+    return winner
+
+# Longest question accepted; Bluesky search queries beyond this are pointless
+MAX_QUESTION_CHARS = 300
+
+@dataclass(frozen=True)
+class AnalyzeForm:
+    """Validated /analyze form fields."""
+    question: str
+    username: Optional[str] = None
+    password: Optional[str] = None
+    
+    @classmethod
+    def parse(cls, form) -> Tuple[Optional["AnalyzeForm"], Optional[str]]:
+        """
+        Validate a submitted form before any client or model work is done.
+        
+        Returns:
+            Tuple of (AnalyzeForm, None) or (None, error message)
+        """
+        question = (form.get('question') or '').strip()
+        if not question:
+            return None, 'Question is required'
+        if len(question) > MAX_QUESTION_CHARS:
+            return None, f'Question must be at most {MAX_QUESTION_CHARS} characters'
+        return cls(question, form.get('username') or None, form.get('password') or None), None
+
+def ojsonify(data):
+    """
+    Like flask.jsonify, but encoded with orjson (when installed) straight to UTF-8.
+    
+    Return it as-is or as (response, status) like jsonify.
+    """
+    return Response(dumps_json(data), mimetype='application/json')
 
 @app.route('/')
 def index():
@@ -43,46 +222,45 @@ def index():
 @app.route('/analyze', methods=['POST'])
 def analyze():
     """Analyze emotions from the form submission."""
-    question = request.form.get('question')
-    username = request.form.get('username')
-    password = request.form.get('password')
-    
     # Validate inputs
-    if not question:
-        return jsonify({'error': 'Question is required'}), 400
+    form, error = AnalyzeForm.parse(request.form)
+    if error:
+        return ojsonify({'error': error}), 400
+    question = form.question
     
     try:
-        # Initialize Bluesky API
-        bluesky_api = BlueskyAPI()  # Initialize without credentials first
-        
-        # Only attempt login if both username and password are provided
-        if username and password:
-            success = bluesky_api.login(username, password)
-            if not success:
-                return jsonify({'error': 'Failed to authenticate with Bluesky. Please check your credentials.'}), 401
+        # Shared Bluesky client; only logs in if both username and password
+        # are provided and there is no live session for them yet
+        bluesky_api = get_bluesky_api(form.username, form.password)
+        if bluesky_api is None:
+            return ojsonify({'error': 'Failed to authenticate with Bluesky. Please check your credentials.'}), 401
         
         # Fetch posts
         posts = bluesky_api.fetch_posts_for_question(question)
         
         if not posts:
-            return jsonify({
+            return ojsonify({
                 'error': 'No posts found for the given question. ' + 
                          ('Try providing valid Bluesky credentials for better results.' if not bluesky_api.is_authenticated else '')
             }), 404
         
         # Analyze emotions
-        emotion_results = emotion_analyzer.get_aggregate_emotions(posts)
+        # The UI only renders per-post emotions for the first few posts
+        emotion_analyzer = get_components()[0]
+        emotion_results = emotion_analyzer.get_aggregate_emotions(posts, detail_limit=DETAIL_POSTS)
         
-        # Store the data needed for proof generation in the session
-        session['analysis_data'] = {
+        # Store the data needed for proof generation server-side; the
+        # session only references it
+        session['analysis_id'] = store_analysis({
             'posts': posts,
             'emotion_results': emotion_results
-        }
+        })
         
         # Prepare response with full emotion data for interactive visualization
         emotion_counts = emotion_results['emotion_counts']
         emotion_scores = emotion_results['emotion_scores']
-        colors = [emotion_analyzer.EMOTION_COLORS[emotion] for emotion in emotion_counts.keys()]
+        # emotion_counts is keyed in LABELS order, which ORDERED_COLORS follows
+        colors = emotion_analyzer.ORDERED_COLORS
         
         # Prepare response
         response = {
@@ -97,20 +275,20 @@ def analyze():
             'sample_posts': posts[:50]  # Process up to 50 posts
         }
         
-        return jsonify(response)
+        return ojsonify(response)
     
     except Exception as e:
         logger.error(f"Error during emotion analysis: {e}")
-        return jsonify({'error': str(e)}), 500
+        return ojsonify({'error': str(e)}), 500
 
 @app.route('/generate_proof', methods=['POST'])
 def generate_proof():
     """Generate a real zero-knowledge proof for the emotion analysis."""
     try:
-        if 'analysis_data' not in session:
-            return jsonify({'error': 'No analysis data available'}), 400
+        analysis_data = load_analysis(session.get('analysis_id'))
+        if analysis_data is None:
+            return ojsonify({'error': 'No analysis data available'}), 400
         
-        analysis_data = session['analysis_data']
         posts = analysis_data['posts']
         emotion_results = analysis_data['emotion_results']
         
@@ -119,48 +297,86 @@ def generate_proof():
         
         # Step 1: Prepare input for the proof generation
         # Convert the posts to a format suitable for ezkl
-        inputs = []
-        for post in posts[:50]:  # Process up to 50 posts using GPU acceleration
-            # Simple preprocessing: convert to lowercase, remove special chars
-            processed = ''.join(c.lower() if c.isalnum() else ' ' for c in post)
-            inputs.append(processed)
-        
-        # Step 2: Create a JSON representation of inputs
-        input_file = os.path.join("ezkl_files", "emotion_input.json")
-        with open(input_file, 'w') as f:
-            json.dump({"inputs": inputs}, f)
+        # Simple preprocessing: convert to lowercase, remove special chars
+        # (process up to 50 posts using GPU acceleration)
+        inputs = [_NON_ALNUM.sub(' ', post[:PROOF_INPUT_CHARS].lower()) for post in posts[:50]]
         
-        # Step 3: Generate proof using ezkl (GPU-accelerated)
-        proof_path = ezkl_integrator.generate_proof(
-            input_path=input_file,
-            output_path="ezkl_files/emotion_proof.json"
-        )
+        # Step 2: Create a JSON representation of inputs; every job gets its
+        # own files so queued proofs don't overwrite each other
+        # (the integrator creates the work directory)
+        _, ezkl_integrator, proof_executor = get_components()
+        job_id = uuid.uuid4().hex
+        input_file = work_path(f"emotion_input_{job_id}.json")
+        write_json(input_file, {"inputs": inputs})
         
-        if not proof_path:
-            return jsonify({
-                'success': False,
-                'message': 'Failed to generate proof',
-                'verification': 'Proof generation failed'
-            })
+        # Step 3: Generate proof using ezkl (GPU-accelerated) and
+        # Step 4: verify it, both in the background proof worker, which
+        # removes the job's files once it has the verdict
+        try:
+            future = proof_executor.submit(
+                run_proof, ezkl_integrator, input_file,
+                work_path(f"emotion_proof_{job_id}.json"),
+                work_path(f"witness_{job_id}.json")
+            )
+        except Exception:
+            os.remove(input_file)
+            raise
+        store_proof_job(job_id, future, replaces=session.get('proof_job'))
+        session['proof_job'] = job_id
         
-        # Step 4: Verify the proof
-        verification_result = ezkl_integrator.verify_proof(proof_path=proof_path)
+        return ojsonify({'success': True, 'job_id': job_id}), 202
         
-        # Return verification result
-        return jsonify({
-            'success': True,
-            'message': 'Zero-knowledge proof generated successfully',
-            'verification': 'The emotion analysis result was verified using zero-knowledge proofs, ensuring privacy of the analyzed posts.',
-            'is_verified': verification_result
+    except Exception as e:
+        logger.error(f"Error generating proof: {e}")
+        return ojsonify({
+            'success': False,
+            'message': f'Error generating proof: {str(e)}',
+            'verification': 'Proof generation failed'
         })
-        
+
+@app.route('/proof_status/<job_id>')
+def proof_status(job_id):
+    """Report whether a background proof job is still running, and its result once done."""
+    with _proof_jobs_lock:
+        entry = _proof_jobs.get(job_id)
+    if entry is None or session.get('proof_job') != job_id:
+        return ojsonify({'error': 'Unknown proof job'}), 404
+    future = entry[0]
+    
+    if not future.done():
+        return ojsonify({'status': 'running'})
+    
+    # Finished jobs are reported once, then forgotten
+    with _proof_jobs_lock:
+        _proof_jobs.pop(job_id, None)
+    
+    try:
+        proof_generated, verification_result = future.result()
     except Exception as e:
         logger.error(f"Error generating proof: {e}")
-        return jsonify({
+        return ojsonify({
+            'status': 'done',
             'success': False,
             'message': f'Error generating proof: {str(e)}',
             'verification': 'Proof generation failed'
         })
+    
+    if not proof_generated:
+        return ojsonify({
+            'status': 'done',
+            'success': False,
+            'message': 'Failed to generate proof',
+            'verification': 'Proof generation failed'
+        })
+    
+    # Return verification result
+    return ojsonify({
+        'status': 'done',
+        'success': True,
+        'message': 'Zero-knowledge proof generated successfully',
+        'verification': 'The emotion analysis result was verified using zero-knowledge proofs, ensuring privacy of the analyzed posts.',
+        'is_verified': verification_result
+    })
 
 @app.route('/test_auth', methods=['POST'])
 def test_auth():
@@ -169,18 +385,17 @@ def test_auth():
     password = request.form.get('password')
     
     if not username or not password:
-        return jsonify({'error': 'Both username and password are required'}), 400
+        return ojsonify({'error': 'Both username and password are required'}), 400
     
     try:
-        bluesky_api = BlueskyAPI()
-        success = bluesky_api.login(username, password)
-        
-        if success:
-            return jsonify({'success': True, 'message': 'Authentication successful'})
+        # A successful test also warms the shared client for /analyze
+        if get_bluesky_api(username, password) is not None:
+            return ojsonify({'success': True, 'message': 'Authentication successful'})
         else:
-            return jsonify({'error': 'Authentication failed. Invalid username or password.'}), 401
+            return ojsonify({'error': 'Authentication failed. Invalid username or password.'}), 401
     except Exception as e:
-        return jsonify({'error': f'Authentication error: {str(e)}'}), 500
+        return ojsonify({'error': f'Authentication error: {str(e)}'}), 500
 
 if __name__ == '__main__':
+    get_components()
     app.run(debug=True, host='0.0.0.0', port=5000)
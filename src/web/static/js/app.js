@@ -120,27 +120,53 @@ $(document).ready(function() {
             }
         }, 2000);
         
+        function showProofResult(response) {
+            clearInterval(progressInterval);
+            $('#generateProofBtn').prop('disabled', false).html(`
+                <i class="fas fa-shield-alt me-2"></i>Generate Zero-Knowledge Proof
+            `);
+            
+            $('#zkProofMessage').text(response.success ? response.verification : response.message);
+            $('#zkProofResult')
+                .removeClass(response.success ? 'alert-danger' : 'alert-info')
+                .addClass(response.success ? 'alert-info' : 'alert-danger')
+                .slideDown();
+        }
+        
+        function showProofError() {
+            clearInterval(progressInterval);
+            $('#generateProofBtn').prop('disabled', false).html('<i class="fas fa-shield-alt me-2"></i>Generate Zero-Knowledge Proof');
+            $('#zkProofMessage').text('Failed to generate proof. Please try again.');
+            $('#zkProofResult').removeClass('alert-info').addClass('alert-danger').slideDown();
+        }
+        
+        // Proofs run as background jobs; poll until the job reports a result
+        function pollProofStatus(jobId) {
+            $.ajax({
+                url: '/proof_status/' + jobId,
+                type: 'GET',
+                success: function(response) {
+                    if (response.status === 'running') {
+                        setTimeout(function() { pollProofStatus(jobId); }, 2000);
+                    } else {
+                        showProofResult(response);
+                    }
+                },
+                error: showProofError
+            });
+        }
+        
         $.ajax({
             url: '/generate_proof',
             type: 'POST',
             success: function(response) {
-                clearInterval(progressInterval);
-                $('#generateProofBtn').prop('disabled', false).html(`
-                    <i class="fas fa-shield-alt me-2"></i>Generate Zero-Knowledge Proof
-                `);
-                
-                $('#zkProofMessage').text(response.success ? response.verification : response.message);
-                $('#zkProofResult')
-                    .removeClass(response.success ? 'alert-danger' : 'alert-info')
-                    .addClass(response.success ? 'alert-info' : 'alert-danger')
-                    .slideDown();
+                if (response.job_id) {
+                    pollProofStatus(response.job_id);
+                } else {
+                    showProofResult(response);
+                }
             },
-            error: function() {
-                clearInterval(progressInterval);
-                $('#generateProofBtn').prop('disabled', false).html('<i class="fas fa-shield-alt me-2"></i>Generate Zero-Knowledge Proof');
-                $('#zkProofMessage').text('Failed to generate proof. Please try again.');
-                $('#zkProofResult').removeClass('alert-info').addClass('alert-danger').slideDown();
-            }
+            error: showProofError
         });
     });
 
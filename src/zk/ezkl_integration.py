@@ -1,10 +1,187 @@
 import ezkl
-import json
 import os
+import hashlib
 import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from pathlib import Path
-import numpy as np
-import torch  # Add this import at the top
+from src.utils.json_io import read_json, write_json
+
+try:
+    import blake3
+except ImportError:  # blake3 is optional; BLAKE2b is the stdlib fallback
+    blake3 = None
+
+# Circuit size (2^LOGROWS rows) requested before calibration; override with EZKL_LOGROWS
+LOGROWS = int(os.environ.get("EZKL_LOGROWS", 17))
+# Rough GPU memory needed per proof in a batch, used to size batch_size
+PROOF_BYTES_PER_SAMPLE = 256 * 1024 * 1024
+MAX_PROVING_BATCH = 64
+# Batch size when proving on CPU
+CPU_PROVING_BATCH = 16
+
+# Per-proof scratch files (inputs, witnesses, proofs) go to RAM-backed tmpfs
+# when there is one; circuit, keys and settings stay in ezkl_files
+WORK_DIR = "/dev/shm/ezkl" if os.path.isdir("/dev/shm") else "ezkl_files"
+
+def work_path(name):
+    """Path of a scratch file in WORK_DIR."""
+    return os.path.join(WORK_DIR, name)
+
+# Digest of the ONNX model the artifacts in ezkl_files were generated from
+MODEL_HASH_PATH = os.path.join("ezkl_files", "model_hash.txt")
+
+def _model_digest(model_path):
+    """Content hash of a model file, read in chunks."""
+    hasher = blake3.blake3() if blake3 is not None else hashlib.blake2b()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _cuda_available():
+    """Check for a CUDA GPU; torch is only imported when a circuit needs it."""
+    import torch
+    return torch.cuda.is_available()
+
+def _proving_batch_size():
+    """
+    Largest power-of-two batch that fits in half the free GPU memory.
+    
+    Falls back to CPU_PROVING_BATCH without a GPU.
+    """
+    if not _cuda_available():
+        return CPU_PROVING_BATCH
+    import torch
+    free, _ = torch.cuda.mem_get_info()
+    samples = max(1, free // (2 * PROOF_BYTES_PER_SAMPLE))
+    return min(MAX_PROVING_BATCH, 1 << (int(samples).bit_length() - 1))
+
+def _enable_gpu_backend():
+    """Route ezkl's MSM/NTT through the ICICLE GPU backend when a GPU is present."""
+    if _cuda_available():
+        os.environ.setdefault("ENABLE_ICICLE_GPU", "true")
+        return True
+    return False
+
+def _gpu_count():
+    """Number of visible CUDA GPUs (0 without CUDA)."""
+    if not _cuda_available():
+        return 0
+    import torch
+    return torch.cuda.device_count()
+
+# Serializes the temporary CUDA_VISIBLE_DEVICES change while a worker spawns
+_SPAWN_LOCK = threading.Lock()
+
+def _spawn_pinned_worker(context, device):
+    """
+    Single-worker process pool whose process only sees GPU `device`.
+    
+    CUDA reads CUDA_VISIBLE_DEVICES once, when the driver initializes, so it
+    has to be in the environment the worker is spawned with; setting it from
+    inside the worker can come too late. The worker is started right away,
+    while the variable is set.
+    """
+    executor = ProcessPoolExecutor(max_workers=1, mp_context=context)
+    with _SPAWN_LOCK:
+        previous = os.environ.get("CUDA_VISIBLE_DEVICES")
+        # Device indices are relative to the GPUs this process can see
+        visible = previous.split(",")[device] if previous else str(device)
+        os.environ["CUDA_VISIBLE_DEVICES"] = visible
+        try:
+            executor.submit(os.getpid).result()
+        finally:
+            if previous is None:
+                del os.environ["CUDA_VISIBLE_DEVICES"]
+            else:
+                os.environ["CUDA_VISIBLE_DEVICES"] = previous
+    return executor
+
+class _ProofPool:
+    """
+    Single-worker process pools used together; jobs go to the least busy one.
+    
+    A pool whose worker died (BrokenProcessPool, e.g. after running out of GPU
+    memory) is replaced with a fresh one from its factory, so later jobs on
+    that device don't all fail.
+    """
+    
+    def __init__(self, factories):
+        self._factories = factories
+        self._executors = [factory() for factory in factories]
+        self._pending = [0] * len(factories)
+        # Executors seen raising BrokenProcessPool, replaced on next use
+        self._dead = set()
+        self._lock = threading.Lock()
+        # Held while respawning a worker, which can take a while
+        self._replace_lock = threading.Lock()
+    
+    def submit(self, fn, *args):
+        with self._lock:
+            index = min(range(len(self._executors)), key=self._pending.__getitem__)
+            self._pending[index] += 1
+            executor = self._executors[index]
+            dead = executor in self._dead
+        try:
+            if dead:
+                executor = self._replace(index, executor)
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                executor = self._replace(index, executor)
+                future = executor.submit(fn, *args)
+        except Exception:
+            self._finished(index)
+            raise
+        future.add_done_callback(lambda f: self._finished(index, executor, f))
+        return future
+    
+    def _finished(self, index, executor=None, future=None):
+        with self._lock:
+            self._pending[index] -= 1
+            if (future is not None and not future.cancelled()
+                    and isinstance(future.exception(), BrokenProcessPool)):
+                self._dead.add(executor)
+    
+    def _replace(self, index, broken):
+        """Swap a broken executor for a fresh one, unless another thread already did."""
+        with self._replace_lock:
+            with self._lock:
+                current = self._executors[index]
+            if current is not broken:
+                return current
+            logging.warning(f"Proof worker {index} died, starting a new one")
+            broken.shutdown(wait=False)
+            executor = self._factories[index]()
+            with self._lock:
+                self._executors[index] = executor
+                self._dead.discard(broken)
+            return executor
+    
+    def shutdown(self, wait=True):
+        for executor in self._executors:
+            executor.shutdown(wait=wait)
+
+def make_proof_executor():
+    """
+    Process pool for run_proof with one worker per GPU.
+    
+    Each worker is spawned with CUDA_VISIBLE_DEVICES set to a single GPU, so
+    concurrent proofs never share a device. Without a GPU there is a single
+    worker, which keeps CPU proving memory bounded. Workers are spawned, so
+    they only import the modules needed to unpickle their jobs, not the
+    caller's models and threads (provided the main script doesn't load them
+    at import time).
+    """
+    context = multiprocessing.get_context("spawn")
+    gpu_count = _gpu_count()
+    if not gpu_count:
+        return _ProofPool([partial(ProcessPoolExecutor, max_workers=1, mp_context=context)])
+    return _ProofPool([partial(_spawn_pinned_worker, context, device) for device in range(gpu_count)])
 
 class EZKLIntegrator:
     def __init__(self, model_path=None):
@@ -22,6 +199,33 @@ class EZKLIntegrator:
         
         # Create necessary directories
         os.makedirs("ezkl_files", exist_ok=True)
+        os.makedirs(WORK_DIR, exist_ok=True)
+        
+        # Pick up circuit and keys from an earlier prepare_model run
+        if self.model_path and os.path.exists(self.model_path):
+            self._load_cached_artifacts()
+
+    def _load_cached_artifacts(self):
+        """
+        Use existing circuit, SRS and keys if they were built from the current model.
+        
+        Returns:
+            True if all artifacts exist and match the model's hash
+        """
+        paths = {
+            'circuit_path': os.path.join("ezkl_files", "circuit.ezkl"),
+            'srs_path': os.path.join("ezkl_files", "kzg.srs"),
+            'pk_path': os.path.join("ezkl_files", "pk.key"),
+            'vk_path': os.path.join("ezkl_files", "vk.key"),
+        }
+        if not os.path.exists(MODEL_HASH_PATH) or not all(os.path.exists(p) for p in paths.values()):
+            return False
+        with open(MODEL_HASH_PATH) as f:
+            if f.read().strip() != _model_digest(self.model_path):
+                return False
+        for name, path in paths.items():
+            setattr(self, name, path)
+        return True
 
     def prepare_model(self, model_path=None):
         """Prepare the model for use with EZKL."""
@@ -36,31 +240,36 @@ class EZKLIntegrator:
             logging.error(f"Model path not specified or does not exist: {self.model_path}")
             return False
         
+        if self._load_cached_artifacts():
+            logging.info("EZKL artifacts are up to date for this model, skipping setup")
+            return True
+        
         try:
             # Create settings for the circuit
             settings_path = os.path.join("ezkl_files", "settings.json")
             ezkl.gen_settings(self.model_path, settings_path)
             
             # Configure acceleration
-            with open(settings_path, 'r') as f:
-                settings = json.load(f)
+            settings = read_json(settings_path)
             
-            settings['run_args'] = {
-                'accelerate': True, 
-                'device': 'cuda' if torch.cuda.is_available() else 'cpu'
-            }
+            # Add to the generated run_args rather than replacing them, so
+            # scales and visibility settings from gen_settings survive
+            use_gpu = _enable_gpu_backend()
+            settings['run_args'].update({
+                'accelerate': True,
+                'device': 'cuda' if use_gpu else 'cpu',
+                'logrows': LOGROWS,
+            })
             
             settings['proving_args'] = {
-                'batch_size': 16
+                'batch_size': _proving_batch_size()
             }
             
-            with open(settings_path, 'w') as f:
-                json.dump(settings, f, indent=2)
+            write_json(settings_path, settings, indent=True)
             
             # Create dummy input and calibrate
             dummy_input_path = os.path.join("ezkl_files", "dummy_input.json")
-            with open(dummy_input_path, 'w') as f:
-                json.dump({"input_0": [[1.0] * 10] * 5}, f)
+            write_json(dummy_input_path, {"input_0": [[1.0] * 10] * 5})
             
             ezkl.calibrate_settings(self.model_path, settings_path, dummy_input_path)
             
@@ -75,12 +284,16 @@ class EZKLIntegrator:
             self.vk_path = os.path.join("ezkl_files", "vk.key")
             ezkl.setup(self.circuit_path, self.srs_path, self.pk_path, self.vk_path, settings_path)
             
+            # Remember which model these artifacts belong to
+            with open(MODEL_HASH_PATH, 'w') as f:
+                f.write(_model_digest(self.model_path))
+            
             return True
         except Exception as e:
             logging.error(f"Error preparing model for EZKL: {e}")
             return False
     
-    def prepare_input(self, input_data, input_path="ezkl_files/input.json"):
+    def prepare_input(self, input_data, input_path=work_path("input.json")):
         """
         Prepare input data for EZKL.
         
@@ -89,16 +302,12 @@ class EZKLIntegrator:
             input_path: Path to save the input JSON file
         """
         try:
-            # Convert input data to the format expected by EZKL
-            if isinstance(input_data, np.ndarray):
-                input_data = input_data.tolist()
-            
-            # Create a simple dictionary structure for the input
+            # Create a simple dictionary structure for the input; NumPy
+            # arrays are serialized directly, without a tolist() copy
             input_dict = {"input_0": input_data}
             
             # Save to JSON
-            with open(input_path, 'w') as f:
-                json.dump(input_dict, f)
+            write_json(input_path, input_dict)
             
             logging.info(f"Input data prepared and saved to {input_path}")
             return input_path
@@ -106,8 +315,8 @@ class EZKLIntegrator:
             logging.error(f"Error preparing input data: {e}")
             return None
     
-    def generate_proof(self, input_path, output_path="ezkl_files/proof.json", 
-                      witness_path="ezkl_files/witness.json", settings_path="ezkl_files/settings.json"):
+    def generate_proof(self, input_path, output_path=work_path("proof.json"), 
+                      witness_path=work_path("witness.json"), settings_path="ezkl_files/settings.json"):
         """
         Generate a zero-knowledge proof for the given input.
         
@@ -122,19 +331,17 @@ class EZKLIntegrator:
         """
         try:
             # Update settings for GPU optimization
-            with open(settings_path, 'r') as f:
-                settings = json.load(f)
+            settings = read_json(settings_path)
             
             # Check if GPU is available
-            if torch.cuda.is_available():
+            if _enable_gpu_backend():
                 logging.info("GPU acceleration enabled for proof generation")
                 settings['run_args'] = settings.get('run_args', {})
                 settings['run_args']['accelerate'] = True
                 settings['run_args']['device'] = 'cuda'
                 
                 # Save updated settings
-                with open(settings_path, 'w') as f:
-                    json.dump(settings, f, indent=2)
+                write_json(settings_path, settings, indent=True)
             
             # Generate witness
             ezkl.gen_witness(self.circuit_path, input_path, witness_path, settings_path)
@@ -150,7 +357,7 @@ class EZKLIntegrator:
             logging.error(f"Traceback: {traceback.format_exc()}")
             return None
     
-    def verify_proof(self, proof_path="ezkl_files/proof.json", settings_path="ezkl_files/settings.json"):
+    def verify_proof(self, proof_path=work_path("proof.json"), settings_path="ezkl_files/settings.json"):
         """
         Verify a zero-knowledge proof.
         
@@ -184,25 +391,48 @@ class EZKLIntegrator:
             Path to the prepared input file
         """
         try:
-            # Tokenize
-            inputs = tokenizer(text, return_tensors="pt")
-            
-            # Convert to numpy arrays
-            input_ids = inputs["input_ids"].numpy()
-            attention_mask = inputs["attention_mask"].numpy()
+            # Tokenize straight to numpy arrays
+            inputs = tokenizer(text, return_tensors="np")
             
             # Prepare inputs
             input_dict = {
-                "input_ids": input_ids.tolist(),
-                "attention_mask": attention_mask.tolist()
+                "input_ids": inputs["input_ids"],
+                "attention_mask": inputs["attention_mask"]
             }
             
             # Save to file
-            input_path = "ezkl_files/input.json"
-            with open(input_path, 'w') as f:
-                json.dump(input_dict, f)
+            input_path = work_path("input.json")
+            write_json(input_path, input_dict)
             
             return input_path
         except Exception as e:
             logging.error(f"Error tokenizing and preparing input: {e}")
             return None
+
+
+def run_proof(integrator, input_path, output_path, witness_path=work_path("witness.json")):
+    """
+    Generate and verify a proof; meant to run in a worker process.
+    
+    Only the verdict is returned: the input, witness and proof files are
+    removed afterwards, since in WORK_DIR they occupy RAM.
+    
+    Args:
+        integrator: A prepared EZKLIntegrator (pickled into the worker)
+        input_path: Path to the input JSON file
+        output_path: Path to save the output proof
+        witness_path: Path to save the witness
+    
+    Returns:
+        Tuple of (whether a proof was generated, verification result)
+    """
+    try:
+        proof_path = integrator.generate_proof(input_path=input_path, output_path=output_path,
+                                               witness_path=witness_path)
+        if not proof_path:
+            return False, False
+        return True, integrator.verify_proof(proof_path=proof_path)
+    finally:
+        for path in (input_path, witness_path, output_path):
+            if os.path.exists(path):
+                os.remove(path)